@@ -3,12 +3,12 @@
 from more_itertools import partition
 import numpy as np
 from nav_msgs.msg import Path
-from geometry_msgs.msg import PoseStamped
 from scipy.spatial.transform import Rotation
 from scipy import spatial
 
 from src.fgsp.common.utils import Utils
 from src.fgsp.common.logger import Logger
+from src.fgsp.common.msg_codec import MsgCodec
 from src.fgsp.common.transform_history import TransformHistory, ConstraintType
 
 
@@ -46,11 +46,7 @@ class ClassificationResult(object):
             return []
 
     def get_ts_from_nodes(self, nodes):
-        ts = []
-        for node_idx in nodes:
-            node = self.opt_nodes[node_idx]
-            ts.append(Utils.ros_time_msg_to_ns(node.ts))
-        return np.array(ts)
+        return self.opt_nodes.ts[np.asarray(nodes, dtype=np.int64)]
 
     def take_every_nth_node(self):
         n_steps = 15
@@ -67,8 +63,9 @@ class ClassificationResult(object):
         partitioned_nodes = []
         prev = 0
         prev_id = 0
+        ids = self.opt_nodes.ids
         for i in range(0, self.n_nodes):
-            cur_id = self.opt_nodes[i].id
+            cur_id = ids[i]
             if cur_id != prev_id:
                 pivot = (i + prev) // 2
                 partitioned_nodes.append(pivot)
@@ -158,7 +155,7 @@ class ClassificationResult(object):
 
     def lookup_closest_submap(self, cur_opt):
         ts_diff = np.absolute(self.ts_partitions -
-                              Utils.ros_time_msg_to_ns(cur_opt.ts))
+                              cur_opt.ts_ns)
         ts_min = np.amin(ts_diff)
 
         # Retrieve the index in opt_nodes.
@@ -166,8 +163,7 @@ class ClassificationResult(object):
         return self.partitions[partition_idx]
 
     def lookup_spatially_close_submaps(self, submap_idx):
-        submap_positions = [
-            self.opt_nodes[i].position for i in self.partitions]
+        submap_positions = self.opt_nodes.positions[self.partitions]
         if len(submap_positions) == 0:
             return []
         dists_along_graph = self.compute_distances_along_graph(
@@ -268,18 +264,6 @@ class ClassificationResult(object):
                 counter = counter + 1
         return relative_constraint, history, counter
 
-    def create_pose_msg_from_node(self, cur_opt):
-        pose_msg = PoseStamped()
-        pose_msg.header.stamp = cur_opt.ts
-        pose_msg.pose.position.x = cur_opt.position[0]
-        pose_msg.pose.position.y = cur_opt.position[1]
-        pose_msg.pose.position.z = cur_opt.position[2]
-        pose_msg.pose.orientation.w = cur_opt.orientation[0]
-        pose_msg.pose.orientation.x = cur_opt.orientation[1]
-        pose_msg.pose.orientation.y = cur_opt.orientation[2]
-        pose_msg.pose.orientation.z = cur_opt.orientation[3]
-        return pose_msg
-
     def compute_relative_distance(self, opt_node_from, opt_node_to):
         T_G_B_a = self.create_transformation_from_node(opt_node_from)
         T_G_B_b = self.create_transformation_from_node(opt_node_to)
@@ -288,17 +272,7 @@ class ClassificationResult(object):
 
     def create_pose_msg(self, opt_node_to, T_a_b):
         t_a_b, q_a_b = self.convert_transform(T_a_b)
-
-        pose_msg = PoseStamped()
-        pose_msg.header.stamp = opt_node_to.ts
-        pose_msg.pose.position.x = t_a_b[0]
-        pose_msg.pose.position.y = t_a_b[1]
-        pose_msg.pose.position.z = t_a_b[2]
-        pose_msg.pose.orientation.x = q_a_b[0]
-        pose_msg.pose.orientation.y = q_a_b[1]
-        pose_msg.pose.orientation.z = q_a_b[2]
-        pose_msg.pose.orientation.w = q_a_b[3]
-        return pose_msg
+        return MsgCodec.create_pose_stamped_msg(opt_node_to.ts_ns, t_a_b, q_a_b[[3, 0, 1, 2]])
 
     def convert_transform(self, T_a_b):
         pos = T_a_b[0:3, 3]
@@ -306,6 +280,4 @@ class ClassificationResult(object):
         return pos, Rotation.from_matrix(R).as_quat()  # x, y, z, w
 
     def create_transformation_from_node(self, node):
-        pose_msg = self.create_pose_msg_from_node(node)
-        pos, orien = Utils.convert_pose_stamped_msg_to_array(pose_msg)
-        return Utils.convert_pos_quat_to_transformation(pos, orien)
+        return Utils.convert_pos_quat_to_transformation(node.position, node.orientation)
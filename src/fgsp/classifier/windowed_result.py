@@ -1,7 +1,12 @@
 #! /usr/bin/env python3
 
 import numpy as np
+from scipy import sparse
+from concurrent.futures import ThreadPoolExecutor
+
 from src.fgsp.controller.signal_handler import SignalHandler
+from src.fgsp.graph.base_graph import compute_k_hop_neighborhood
+from src.fgsp.graph.lazy_graph import LazyGraph
 from src.fgsp.graph.wavelet_evaluator import WaveletEvaluator
 from src.fgsp.classifier import ClassificationResult
 
@@ -12,7 +17,7 @@ class WindowedResult(ClassificationResult):
         assert config.use_graph_hierarchies
         assert not config.use_downstreaming
 
-        self.indices = graph.get_indices()
+        self.clusters = graph.get_clusters()
         self.graph = graph
         self.est_nodes = est_nodes
         n_nodes = len(self.opt_nodes)
@@ -21,7 +26,6 @@ class WindowedResult(ClassificationResult):
     def create_windowed_labels(self, n_nodes, labels):
         # Labels in the current hierarchy
         n_labels = len(labels)
-        last_label = n_labels - 1
 
         signal = SignalHandler(self.config)
         x_est = signal.compute_signal(self.est_nodes)
@@ -33,34 +37,77 @@ class WindowedResult(ClassificationResult):
         if self.n_labels == 0:
             return downstream_labels
 
-        for idx in range(0, last_label):
-            if len(labels[idx]) == 0:
+        # Collect the level-0 nodes of every labelled cluster.
+        order = np.argsort(self.clusters[:n_nodes], kind='stable')
+        bounds = np.searchsorted(
+            self.clusters[order], np.arange(n_labels + 1))
+        windows = []
+        for idx in range(0, n_labels):
+            if not labels[idx]:
                 continue
+            node_range = order[bounds[idx]:bounds[idx+1]]
+            windows.append((node_range, labels[idx]))
 
-            # Compute the windowed wavelets in the initial graph.
-            node_range = np.arange(
-                self.indices[idx], self.indices[idx+1], dtype=int)
-            features = self.evaluate_node_range(node_range, x_est, x_opt)
+        if len(windows) == 0:
+            return downstream_labels
 
-            for lbl in labels[idx]:
+        # All windows share the same level-0 decomposition.
+        node_ranges = [node_range for node_range, _ in windows]
+        features = self.evaluate_node_ranges(node_ranges, x_est, x_opt)
+        for node_range, window_labels in windows:
+            for lbl in window_labels:
                 max_n = node_range[np.argmax(features[node_range, lbl-1])]
                 downstream_labels[max_n].append(lbl)
 
-        # Fix remainder
-        node_range = np.arange(self.indices[last_label], n_nodes, dtype=int)
-        features = self.evaluate_node_range(node_range, x_est, x_opt)
-        for lbl in labels[last_label]:
-            max_n = node_range[np.argmax(features[node_range, lbl-1])]
-            downstream_labels[max_n].append(lbl)
-
         return downstream_labels
 
-    def evaluate_node_range(self, node_range, x_est, x_opt):
-        # Compute the windowed wavelets in the initial graph.
-        eval = WaveletEvaluator()
-        eval.compute_wavelets(self.graph.get_graph(0), node_range)
+    def create_evaluator(self):
+        engine = 'chebyshev' if self.config.wavelet_engine == 'chebyshev' else 'spectral_direct'
+        return WaveletEvaluator(
+            engine=engine, chebyshev_order=self.config.chebyshev_order,
+            feature_columns=self.config.feature_columns)
 
-        # Compute the windowed features for the windowed wavelets.
-        W_est = eval.compute_wavelet_coeffs(x_est)
-        W_opt = eval.compute_wavelet_coeffs(x_opt)
+    def evaluate_node_ranges(self, node_ranges, x_est, x_opt):
+        if self.config.windowed_hop_radius > 0:
+            return self.evaluate_subgraphs(node_ranges, x_est, x_opt)
+
+        # The coefficient of a node only depends on its own wavelet, hence
+        # only the rows within the windows are computed.
+        eval = self.create_evaluator()
+        eval.compute_wavelets(self.graph.get_graph(0))
+
+        W_est, W_opt = eval.compute_wavelet_coeffs_batch(
+            [x_est, x_opt], node_ranges, self.config.windowed_workers)
         return eval.compute_features(W_opt, W_est)
+
+    def evaluate_subgraphs(self, node_ranges, x_est, x_opt):
+        # Evaluates every window on its k-hop neighbourhood in the level-0 graph.
+        adj = sparse.csr_matrix(self.graph.get_graph(0).W)
+        n_features = len(self.create_evaluator().feature_columns)
+        features = np.zeros((x_est.shape[0], n_features))
+
+        def evaluate(node_range):
+            features[node_range] = self.evaluate_subgraph(
+                adj, node_range, x_est, x_opt)
+
+        workers = max(1, self.config.windowed_workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(evaluate, node_ranges))
+        return features
+
+    def evaluate_subgraph(self, adj, node_range, x_est, x_opt):
+        nodes = compute_k_hop_neighborhood(
+            adj, node_range, self.config.windowed_hop_radius)
+        window = np.searchsorted(nodes, node_range)
+        G = LazyGraph(adj[nodes, :][:, nodes])
+
+        eval = self.create_evaluator()
+        if eval.engine == 'chebyshev':
+            G.estimate_lmax()
+        else:
+            G.compute_fourier_basis()
+        eval.compute_wavelets(G)
+
+        W_est, W_opt = eval.compute_wavelet_coeffs_batch(
+            [x_est[nodes], x_opt[nodes]], [window])
+        return eval.compute_features(W_opt, W_est)[window]
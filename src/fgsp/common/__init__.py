@@ -1,5 +1,8 @@
 from .utils import Utils
+from .lie_utils import LieUtils
 from .config import MonitorConfig, ClientConfig
 from .plotter import Plotter
 from .visualizer import Visualizer
 from .logger import Logger
+from .trajectory_store import TrajectoryStore
+from .msg_codec import MsgCodec
@@ -25,12 +25,22 @@ class MonitorConfig(BaseConfig):
         self.min_node_count = 10
         self.submap_min_count = 3
         self.send_separate_traj_msgs = True
+        self.trajectory_change_tolerance_m = 1e-3
+        self.trajectory_change_tolerance_rad = 1e-3
 
         # Reduction settings.
         self.reduce_global_graph = False
         self.reduction_method = 'positive_ev'
         self.reduce_to_n_percent = 1.0
 
+        # Spectral settings.
+        self.fourier_basis_method = 'full'
+        self.fourier_basis_n_eigenvectors = 300
+        self.fourier_basis_band_center = 0.0
+        self.fourier_basis_warm_start = False
+        self.fourier_basis_warm_start_tol = 1e-4
+        self.fourier_basis_warm_start_n_extra = 10
+
         # submap constraints
         self.pivot_distance = 20.0
         self.min_pivot_distance = 20.0
@@ -58,6 +68,10 @@ class MonitorConfig(BaseConfig):
             "min_node_count", self.min_node_count)
         self.send_separate_traj_msgs = self.try_get_param(
             "send_separate_traj_msgs", self.send_separate_traj_msgs)
+        self.trajectory_change_tolerance_m = self.try_get_param(
+            "trajectory_change_tolerance_m", self.trajectory_change_tolerance_m)
+        self.trajectory_change_tolerance_rad = self.try_get_param(
+            "trajectory_change_tolerance_rad", self.trajectory_change_tolerance_rad)
 
         # Reduction settings.
         self.reduce_global_graph = self.try_get_param(
@@ -67,6 +81,20 @@ class MonitorConfig(BaseConfig):
         self.reduce_to_n_percent = self.try_get_param(
             "reduce_to_n_percent", self.reduce_to_n_percent)
 
+        # Spectral settings.
+        self.fourier_basis_method = self.try_get_param(
+            "fourier_basis_method", self.fourier_basis_method)
+        self.fourier_basis_n_eigenvectors = self.try_get_param(
+            "fourier_basis_n_eigenvectors", self.fourier_basis_n_eigenvectors)
+        self.fourier_basis_band_center = self.try_get_param(
+            "fourier_basis_band_center", self.fourier_basis_band_center)
+        self.fourier_basis_warm_start = self.try_get_param(
+            "fourier_basis_warm_start", self.fourier_basis_warm_start)
+        self.fourier_basis_warm_start_tol = self.try_get_param(
+            "fourier_basis_warm_start_tol", self.fourier_basis_warm_start_tol)
+        self.fourier_basis_warm_start_n_extra = self.try_get_param(
+            "fourier_basis_warm_start_n_extra", self.fourier_basis_warm_start_n_extra)
+
         # input
         self.in_graph_topic = self.try_get_param(
             "in_graph_topic", self.in_graph_topic)
@@ -101,13 +129,17 @@ class ClientConfig(BaseConfig):
         self.enable_trajectory_recording = False
         self.signal_export_path = "/data/{key}_{src}_signal.npy"
         self.graph_coords_export_path = "/data/{key}_{src}_graph_coords.npy"
-        self.graph_adj_export_path = "/data/{key}_{src}_graph_adj.npy"
+        self.graph_adj_export_path = "/data/{key}_{src}_graph_adj.npz"
         self.trajectory_export_path = "/data/{key}_{src}_trajectory.npy"
         self.trajectory_raw_export_path = "/data/{key}_{src}_raw_trajectory.npy"
         self.label_output_path = "/data/opt_labels.dat"
         self.connections_output_path = "/data/opt_connections.dat"
         self.degenerate_window = 10
         self.synchronization_max_diff_s = 1.0
+        self.synchronization_method = 'nearest'
+        self.path_rewrite_window = 100
+        self.trajectory_change_tolerance_m = 1e-3
+        self.trajectory_change_tolerance_rad = 1e-3
         self.verbosity = 1
         self.warmup_nodes = 10
         self.max_iterations = -1
@@ -115,6 +147,13 @@ class ClientConfig(BaseConfig):
         # constraint construction
         self.client_mode = 'multiscale'
         self.wavelet_scales = 6
+        self.wavelet_engine = 'spectral'
+        self.chebyshev_order = 30
+        self.wavelet_storage = 'dense'
+        self.wavelet_storage_dir = ''
+        self.feature_columns = ['Manhattan_L', 'Manhattan_B', 'Manhattan_H']
+        self.windowed_workers = 1
+        self.windowed_hop_radius = 0
         self.classifier = 'top'
         self.top_classifier_select_n = 10
         self.top_classifier_min_threshold = 0.1
@@ -130,11 +169,28 @@ class ClientConfig(BaseConfig):
 
         # Graph construction
         self.construction_method = 'se3'
+        self.neighborhood_method = 'radius'
+        self.neighborhood_radius = 6.0
+        self.neighborhood_max_degree = 10
+        self.fourier_basis_method = 'full'
+        self.fourier_basis_n_eigenvectors = 300
+        self.fourier_basis_band_center = 0.0
+        self.fourier_basis_warm_start = False
+        self.fourier_basis_warm_start_tol = 1e-4
+        self.fourier_basis_warm_start_n_extra = 10
         self.use_graph_hierarchies = True
         self.max_graph_levels = 2
         self.use_downstreaming = False
         self.graph_hierarchies_node_threshold = 100
-        self.use_parallel_construction = True
+        self.hierarchy_method = 'every_other'
+        self.hierarchy_reduction_ratio = 0.5
+        self.hierarchy_n_eigenvectors = 20
+        self.construction_workers = 1
+        self.use_incremental_construction = True
+        self.incremental_pose_tolerance = 0.01
+        self.use_spectral_cache = False
+        self.spectral_cache_max_mb = 2048
+        self.spectral_cache_disk_max_mb = 0
         self.visualize_graph = False
 
         # input
@@ -186,6 +242,14 @@ class ClientConfig(BaseConfig):
             "degenerate_window", self.degenerate_window)
         self.synchronization_max_diff_s = self.try_get_param(
             "synchronization_max_diff_s", self.synchronization_max_diff_s)
+        self.synchronization_method = self.try_get_param(
+            "synchronization_method", self.synchronization_method)
+        self.path_rewrite_window = self.try_get_param(
+            "path_rewrite_window", self.path_rewrite_window)
+        self.trajectory_change_tolerance_m = self.try_get_param(
+            "trajectory_change_tolerance_m", self.trajectory_change_tolerance_m)
+        self.trajectory_change_tolerance_rad = self.try_get_param(
+            "trajectory_change_tolerance_rad", self.trajectory_change_tolerance_rad)
         self.verbosity = self.try_get_param("verbosity", self.verbosity)
         self.warmup_nodes = self.try_get_param(
             "warmup_nodes", self.warmup_nodes)
@@ -196,6 +260,20 @@ class ClientConfig(BaseConfig):
         self.client_mode = self.try_get_param("client_mode", self.client_mode)
         self.wavelet_scales = self.try_get_param(
             "wavelet_scales", self.wavelet_scales)
+        self.wavelet_engine = self.try_get_param(
+            "wavelet_engine", self.wavelet_engine)
+        self.chebyshev_order = self.try_get_param(
+            "chebyshev_order", self.chebyshev_order)
+        self.wavelet_storage = self.try_get_param(
+            "wavelet_storage", self.wavelet_storage)
+        self.wavelet_storage_dir = self.try_get_param(
+            "wavelet_storage_dir", self.wavelet_storage_dir)
+        self.feature_columns = self.try_get_param(
+            "feature_columns", self.feature_columns)
+        self.windowed_workers = self.try_get_param(
+            "windowed_workers", self.windowed_workers)
+        self.windowed_hop_radius = self.try_get_param(
+            "windowed_hop_radius", self.windowed_hop_radius)
         self.classifier = self.try_get_param("classifier", self.classifier)
         self.top_classifier_select_n = self.try_get_param(
             "top_classifier_select_n", self.top_classifier_select_n)
@@ -222,6 +300,24 @@ class ClientConfig(BaseConfig):
         # Graph construction
         self.construction_method = self.try_get_param(
             "construction_method", self.construction_method)
+        self.neighborhood_method = self.try_get_param(
+            "neighborhood_method", self.neighborhood_method)
+        self.neighborhood_radius = self.try_get_param(
+            "neighborhood_radius", self.neighborhood_radius)
+        self.neighborhood_max_degree = self.try_get_param(
+            "neighborhood_max_degree", self.neighborhood_max_degree)
+        self.fourier_basis_method = self.try_get_param(
+            "fourier_basis_method", self.fourier_basis_method)
+        self.fourier_basis_n_eigenvectors = self.try_get_param(
+            "fourier_basis_n_eigenvectors", self.fourier_basis_n_eigenvectors)
+        self.fourier_basis_band_center = self.try_get_param(
+            "fourier_basis_band_center", self.fourier_basis_band_center)
+        self.fourier_basis_warm_start = self.try_get_param(
+            "fourier_basis_warm_start", self.fourier_basis_warm_start)
+        self.fourier_basis_warm_start_tol = self.try_get_param(
+            "fourier_basis_warm_start_tol", self.fourier_basis_warm_start_tol)
+        self.fourier_basis_warm_start_n_extra = self.try_get_param(
+            "fourier_basis_warm_start_n_extra", self.fourier_basis_warm_start_n_extra)
         self.use_graph_hierarchies = self.try_get_param(
             "use_graph_hierarchies", self.use_graph_hierarchies)
         self.max_graph_levels = self.try_get_param(
@@ -230,8 +326,24 @@ class ClientConfig(BaseConfig):
             "use_downstreaming", self.use_downstreaming)
         self.graph_hierarchies_node_threshold = self.try_get_param(
             "graph_hierarchies_node_threshold", self.graph_hierarchies_node_threshold)
-        self.use_parallel_construction = self.try_get_param(
-            "use_parallel_construction", self.use_parallel_construction)
+        self.hierarchy_method = self.try_get_param(
+            "hierarchy_method", self.hierarchy_method)
+        self.hierarchy_reduction_ratio = self.try_get_param(
+            "hierarchy_reduction_ratio", self.hierarchy_reduction_ratio)
+        self.hierarchy_n_eigenvectors = self.try_get_param(
+            "hierarchy_n_eigenvectors", self.hierarchy_n_eigenvectors)
+        self.construction_workers = self.try_get_param(
+            "construction_workers", self.construction_workers)
+        self.use_incremental_construction = self.try_get_param(
+            "use_incremental_construction", self.use_incremental_construction)
+        self.incremental_pose_tolerance = self.try_get_param(
+            "incremental_pose_tolerance", self.incremental_pose_tolerance)
+        self.use_spectral_cache = self.try_get_param(
+            "use_spectral_cache", self.use_spectral_cache)
+        self.spectral_cache_max_mb = self.try_get_param(
+            "spectral_cache_max_mb", self.spectral_cache_max_mb)
+        self.spectral_cache_disk_max_mb = self.try_get_param(
+            "spectral_cache_disk_max_mb", self.spectral_cache_disk_max_mb)
         self.visualize_graph = self.try_get_param(
             "visualize_graph", self.visualize_graph)
 
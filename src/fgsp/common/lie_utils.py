@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+
+class LieUtils(object):
+    # All poses are (N,7) arrays of position and wxyz quaternion.
+
+    @staticmethod
+    def convert_quat_to_rotation_batch(quats):
+        return Rotation.from_quat(quats[:, [1, 2, 3, 0]]).as_matrix()
+
+    @staticmethod
+    def wedge_so3(phi):
+        n_values = phi.shape[0]
+        Phi = np.zeros((n_values, 3, 3))
+        Phi[:, 0, 1] = -phi[:, 2]
+        Phi[:, 0, 2] = phi[:, 1]
+        Phi[:, 1, 0] = phi[:, 2]
+        Phi[:, 1, 2] = -phi[:, 0]
+        Phi[:, 2, 0] = -phi[:, 1]
+        Phi[:, 2, 1] = phi[:, 0]
+        return Phi
+
+    @staticmethod
+    def wedge_se3(xi):
+        # xi is ordered as [rho, phi] like in liegroups.
+        n_values = xi.shape[0]
+        Xi = np.zeros((n_values, 4, 4))
+        Xi[:, 0:3, 0:3] = LieUtils.wedge_so3(xi[:, 3:6])
+        Xi[:, 0:3, 3] = xi[:, 0:3]
+        return Xi
+
+    @staticmethod
+    def log_so3(R):
+        cos_angle = np.clip(0.5 * np.trace(R, axis1=1, axis2=2) - 0.5, -1., 1.)
+        angle = np.arccos(cos_angle)
+        D = R - np.transpose(R, (0, 2, 1))
+        vee = np.stack([D[:, 2, 1], D[:, 0, 2], D[:, 1, 0]], axis=1)
+
+        # Same branching as liegroups: first order around the identity.
+        large = np.logical_not(np.isclose(angle, 0.))
+        scale = np.full(angle.shape, 0.5)
+        scale[large] = 0.5 * angle[large] / np.sin(angle[large])
+        return scale[:, None] * vee
+
+    @staticmethod
+    def log_se3(R, t):
+        phi = LieUtils.log_so3(R)
+        angle = np.linalg.norm(phi, axis=1)
+
+        # rho = J^-1(phi) * t for all poses at once.
+        small = np.isclose(angle, 0.)
+        large = np.logical_not(small)
+        rho = np.empty(t.shape)
+        rho[small] = t[small] - 0.5 * np.cross(phi[small], t[small])
+
+        axis = phi[large] / angle[large, None]
+        half_angle = 0.5 * angle[large]
+        half_cot = half_angle / np.tan(half_angle)
+        t_large = t[large]
+        rho[large] = half_cot[:, None] * t_large \
+            + (1 - half_cot)[:, None] * axis * np.sum(axis * t_large, axis=1)[:, None] \
+            - half_angle[:, None] * np.cross(axis, t_large)
+        return np.column_stack([rho, phi])
+
+    @staticmethod
+    def relative_se3_log(poses_lhs, poses_rhs):
+        # Computes log(T_lhs^-1 * T_rhs) for each row.
+        R_lhs = LieUtils.convert_quat_to_rotation_batch(poses_lhs[:, 3:7])
+        R_rhs = LieUtils.convert_quat_to_rotation_batch(poses_rhs[:, 3:7])
+        R_lhs_t = np.transpose(R_lhs, (0, 2, 1))
+        R_12 = np.matmul(R_lhs_t, R_rhs)
+        t_12 = np.einsum('nij,nj->ni', R_lhs_t,
+                         poses_rhs[:, 0:3] - poses_lhs[:, 0:3])
+        return LieUtils.log_se3(R_12, t_12)
+
+    @staticmethod
+    def weighted_log_norm(xi, weights):
+        # sqrt(trace(wedge(xi) * diag(weights) * wedge(xi)^T)) for each row.
+        Xi = LieUtils.wedge_se3(xi)
+        inner = np.einsum('nij,j,nij->n', Xi, np.asarray(weights), Xi)
+        return np.sqrt(inner)
+
+    @staticmethod
+    def so3_trace_distance(poses_lhs, poses_rhs):
+        # trace(R_lhs * R_rhs^T) is the sum of the elementwise product.
+        R_lhs = LieUtils.convert_quat_to_rotation_batch(poses_lhs[:, 3:7])
+        R_rhs = LieUtils.convert_quat_to_rotation_batch(poses_rhs[:, 3:7])
+        return np.einsum('nij,nij->n', R_lhs, R_rhs)
+
+    @staticmethod
+    def slerp_quat(quats_lhs, quats_rhs, t):
+        # Interpolates each row along the shorter arc, t is in [0, 1].
+        dot = np.sum(quats_lhs * quats_rhs, axis=1)
+        quats_rhs = np.where((dot < 0)[:, None], -quats_rhs, quats_rhs)
+        dot = np.clip(np.abs(dot), 0.0, 1.0)
+        theta = np.arccos(dot)
+        sin_theta = np.sin(theta)
+
+        # Fall back to a normalized lerp for nearly identical rotations.
+        small = sin_theta < 1e-8
+        safe_sin = np.where(small, 1.0, sin_theta)
+        w_lhs = np.where(small, 1.0 - t, np.sin((1.0 - t) * theta) / safe_sin)
+        w_rhs = np.where(small, t, np.sin(t * theta) / safe_sin)
+        quats = w_lhs[:, None] * quats_lhs + w_rhs[:, None] * quats_rhs
+        return quats / np.linalg.norm(quats, axis=1)[:, None]
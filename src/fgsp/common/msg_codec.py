@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+
+import array
+import numpy as np
+from maplab_msgs.msg import Trajectory, TrajectoryNode
+from geometry_msgs.msg import Point, PoseStamped
+
+from src.fgsp.common.trajectory_store import TrajectoryStore
+
+
+class MsgCodec(object):
+    # Converts whole messages to and from contiguous arrays. Poses are rows
+    # of [position, orientation as wxyz] and timestamps are in ns.
+
+    @staticmethod
+    def read_array_field(values, dtype=np.float64):
+        # The ROS 2 bindings store numeric sequences as array.array.
+        if isinstance(values, array.array):
+            return np.frombuffer(values, dtype=values.typecode).astype(dtype)
+        return np.asarray(values, dtype=dtype)
+
+    @staticmethod
+    def write_array_field(msg, name, values):
+        current = getattr(msg, name)
+        if isinstance(current, array.array):
+            values = np.ascontiguousarray(values, dtype=current.typecode)
+            setattr(msg, name, array.array(
+                current.typecode, values.reshape(-1).tobytes()))
+        else:
+            setattr(msg, name, np.asarray(values).reshape(-1).tolist())
+
+    @staticmethod
+    def read_stamps(headers):
+        stamps = np.array([(h.stamp.sec, h.stamp.nanosec)
+                          for h in headers], dtype=np.int64).reshape(-1, 2)
+        return stamps[:, 0] * 1000000000 + stamps[:, 1]
+
+    @staticmethod
+    def read_poses(pose_msgs):
+        return np.array([(p.position.x, p.position.y, p.position.z,
+                          p.orientation.w, p.orientation.x, p.orientation.y, p.orientation.z)
+                         for p in pose_msgs], dtype=np.float64).reshape(-1, 7)
+
+    @staticmethod
+    def read_pose_stamped_msgs(pose_msgs):
+        # Rows of [position, orientation, ts] as used by the graphs.
+        poses = MsgCodec.read_poses([p.pose for p in pose_msgs])
+        ts = MsgCodec.read_stamps([p.header for p in pose_msgs])
+        return np.column_stack([poses, ts])
+
+    @staticmethod
+    def pose_stamped_msgs_to_store(pose_msgs, robot_name):
+        poses = MsgCodec.read_poses([p.pose for p in pose_msgs])
+        ts = MsgCodec.read_stamps([p.header for p in pose_msgs])
+        degenerate = np.array([p.header.frame_id.lower() == 'degenerate'
+                               for p in pose_msgs], dtype=bool)
+        return TrajectoryStore(robot_name, ts, poses[:, 0:3], poses[:, 3:7],
+                               degenerate=degenerate)
+
+    @staticmethod
+    def trajectory_nodes_to_store(node_msgs, robot_name):
+        poses = MsgCodec.read_poses([n.pose.pose for n in node_msgs])
+        ts = MsgCodec.read_stamps([n.pose.header for n in node_msgs])
+        ids = np.array([n.id for n in node_msgs], dtype=np.int64)
+        residuals = np.array([n.signal for n in node_msgs], dtype=np.float64)
+        return TrajectoryStore(robot_name, ts, poses[:, 0:3], poses[:, 3:7],
+                               ids=ids, residuals=residuals)
+
+    @staticmethod
+    def trajectory_msg_to_stores(traj_msg):
+        stores = {}
+        robot_names = [n.robot_name for n in traj_msg.nodes]
+        for robot_name in dict.fromkeys(robot_names):
+            nodes = [n for n, r in zip(traj_msg.nodes, robot_names)
+                     if r == robot_name]
+            stores[robot_name] = MsgCodec.trajectory_nodes_to_store(
+                nodes, robot_name)
+        return stores
+
+    @staticmethod
+    def create_pose_stamped_msg(ts_ns, position, orientation):
+        pose_msg = PoseStamped()
+        pose_msg.header.stamp = TrajectoryStore.ns_to_time_msg(ts_ns)
+        pose_msg.pose.position.x = float(position[0])
+        pose_msg.pose.position.y = float(position[1])
+        pose_msg.pose.position.z = float(position[2])
+        pose_msg.pose.orientation.w = float(orientation[0])
+        pose_msg.pose.orientation.x = float(orientation[1])
+        pose_msg.pose.orientation.y = float(orientation[2])
+        pose_msg.pose.orientation.z = float(orientation[3])
+        return pose_msg
+
+    @staticmethod
+    def store_to_pose_stamped_msgs(store):
+        # Plain lists avoid creating a NumPy scalar for every field.
+        return [MsgCodec.create_pose_stamped_msg(ts, position, orientation)
+                for ts, position, orientation in zip(store.ts.tolist(),
+                                                     store.positions.tolist(),
+                                                     store.orientations.tolist())]
+
+    @staticmethod
+    def store_to_trajectory_msg(store):
+        traj_msg = Trajectory()
+        pose_msgs = MsgCodec.store_to_pose_stamped_msgs(store)
+        for id, residual, pose_msg in zip(store.ids.tolist(), store.residuals.tolist(), pose_msgs):
+            node_msg = TrajectoryNode()
+            node_msg.id = id
+            node_msg.robot_name = store.robot_name
+            node_msg.pose = pose_msg
+            node_msg.signal = residual
+            traj_msg.nodes.append(node_msg)
+        return traj_msg
+
+    @staticmethod
+    def read_graph_coords(graph_msg):
+        return np.array([(p.x, p.y, p.z) for p in graph_msg.coords],
+                        dtype=np.float64).reshape(-1, 3)
+
+    @staticmethod
+    def read_graph_adjacency(graph_msg):
+        # The message only supports a dense row-major adjacency.
+        n_coords = len(graph_msg.coords)
+        return MsgCodec.read_array_field(graph_msg.adjacency_matrix).reshape(n_coords, n_coords)
+
+    @staticmethod
+    def write_graph_msg(graph_msg, coords, adj):
+        graph_msg.coords = [Point(x=x, y=y, z=z)
+                            for x, y, z in coords[:, 0:3].tolist()]
+        MsgCodec.write_array_field(graph_msg, 'adjacency_matrix', adj)
+        return graph_msg
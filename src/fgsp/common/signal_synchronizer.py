@@ -3,56 +3,101 @@
 import numpy as np
 
 from src.fgsp.common.utils import Utils
+from src.fgsp.common.lie_utils import LieUtils
 from src.fgsp.common.logger import Logger
+from src.fgsp.common.trajectory_store import TrajectoryStore
 
 
 class SignalSynchronizer(object):
 
     def __init__(self, config):
         self.config = config
+        self.method = config.synchronization_method
+        if self.method not in ['nearest', 'interpolate']:
+            Logger.LogError(
+                f'SignalSynchronizer: Unknown method {self.method}. Using nearest.')
+            self.method = 'nearest'
 
     def synchronize(self, optimized, estimated):
         ts_opt = self.extract_timestamps(optimized)
         ts_est = self.extract_timestamps(estimated)
 
-        np.set_printoptions(suppress=True,
-                            formatter={'float_kind': '{:f}'.format})
-
         opt_size = ts_opt.shape[0]
         est_size = ts_est.shape[0]
         min_size = min(opt_size, est_size)
-        est_idx = []
-        opt_idx = []
-
         if min_size != opt_size:
             Logger.LogError(
                 f'SignalSynchronizer: min size is {min_size} and opt is {opt_size}.')
-
-        for i in range(0, min_size):
-            cur_ts = ts_opt[i, 0]
-
-            # TODO(lbern): Check for a max difference.
-            ts_diff = np.absolute(ts_est - cur_ts)
-            ts_min = np.amin(ts_diff)
-            diff_s = Utils.ts_ns_to_seconds(ts_min)
-            if diff_s > self.config.synchronization_max_diff_s:
-                Logger.LogWarn(
-                    f'SignalSynchronizer: closest TS is {diff_s} seconds away.')
-                continue
-
-            cur_min_index = np.where(ts_diff == ts_min)[0]
-            est_idx.append(cur_min_index[0])
-            opt_idx.append(i)
-
-        est_nodes = [estimated[i] for i in est_idx]
-        opt_nodes = [optimized[i] for i in opt_idx]
+        if min_size == 0:
+            empty = np.array([], dtype=np.int64)
+            return (optimized[empty], estimated[empty], empty, empty)
+
+        # Sort the estimated timestamps once and search the optimized ones.
+        ts_opt = ts_opt[0:min_size, 0]
+        est_order = np.argsort(ts_est[:, 0], kind='stable')
+        ts_sorted = ts_est[est_order, 0]
+        lower, upper = self.find_neighbors(ts_sorted, ts_opt)
+        diff_lower = np.absolute(ts_opt - ts_sorted[lower])
+        diff_upper = np.absolute(ts_sorted[upper] - ts_opt)
+
+        # Ties are resolved towards the smaller index of the estimation.
+        take_upper = (diff_upper < diff_lower) | (
+            (diff_upper == diff_lower) & (est_order[upper] < est_order[lower]))
+        nearest = np.where(take_upper, upper, lower)
+        ts_min = np.minimum(diff_lower, diff_upper)
+
+        diff_s = Utils.ts_ns_to_seconds(ts_min)
+        valid = diff_s <= self.config.synchronization_max_diff_s
+        n_invalid = np.count_nonzero(~valid)
+        if n_invalid > 0:
+            Logger.LogWarn(
+                f'SignalSynchronizer: {n_invalid} nodes have no estimate within {self.config.synchronization_max_diff_s} seconds (max {np.max(diff_s)}).')
+
+        opt_idx = np.flatnonzero(valid)
+        est_idx = est_order[nearest[valid]]
+        opt_nodes = optimized[opt_idx]
+        if self.method == 'interpolate':
+            est_nodes = self.interpolate(
+                estimated, ts_opt[valid], est_order[lower[valid]], est_order[upper[valid]], est_idx)
+        else:
+            est_nodes = estimated[est_idx]
 
         return (opt_nodes, est_nodes, opt_idx, est_idx)
 
-    def extract_timestamps(self, signals):
-        n_nodes = len(signals)
-        ts = np.zeros((n_nodes, 1))
-        for i in range(0, n_nodes):
-            ts[i] = Utils.ros_time_msg_to_ns(signals[i].ts)
+    def find_neighbors(self, ts_sorted, ts_query):
+        # Indices of the closest sorted timestamps before and after each query.
+        # The first occurrence is used for repeated timestamps.
+        upper = np.searchsorted(ts_sorted, ts_query, side='left')
+        upper = np.minimum(upper, ts_sorted.shape[0] - 1)
+        lower = np.maximum(upper - 1, 0)
+        lower = np.where(ts_sorted[upper] <= ts_query, upper, lower)
+        lower = np.searchsorted(ts_sorted, ts_sorted[lower], side='left')
+        return lower, upper
+
+    def interpolate(self, estimated, ts_query, lower, upper, nearest):
+        # Linearly interpolates the position and slerps the orientation between
+        # the estimates around every query. Queries that are not enclosed by
+        # two estimates within the max difference keep the nearest estimate.
+        ts_lower = estimated.ts[lower]
+        ts_upper = estimated.ts[upper]
+        max_diff_ns = self.config.synchronization_max_diff_s * 1e9
+        enclosed = (ts_lower < ts_query) & (ts_query < ts_upper) & \
+            (ts_query - ts_lower <= max_diff_ns) & (ts_upper - ts_query <= max_diff_ns)
+
+        t = np.zeros(ts_query.shape[0])
+        t[enclosed] = (ts_query[enclosed] - ts_lower[enclosed]) / \
+            (ts_upper[enclosed] - ts_lower[enclosed])
+        lower = np.where(enclosed, lower, nearest)
+        upper = np.where(enclosed, upper, nearest)
+
+        positions = (1.0 - t)[:, None] * estimated.positions[lower] + \
+            t[:, None] * estimated.positions[upper]
+        orientations = LieUtils.slerp_quat(
+            estimated.orientations[lower], estimated.orientations[upper], t)
+        ts = np.where(enclosed, ts_query, estimated.ts[nearest])
+        return TrajectoryStore(estimated.robot_name, ts, positions, orientations,
+                               estimated.ids[nearest], estimated.residuals[nearest],
+                               estimated.degenerate[nearest])
 
-        return ts
+    def extract_timestamps(self, signals):
+        return signals.ts.reshape(-1, 1)
@@ -0,0 +1,188 @@
+#! /usr/bin/env python3
+
+import numpy as np
+from builtin_interfaces.msg import Time
+
+
+class TrajectoryNodeView(object):
+    # Single row of a trajectory store. Positions and orientations are views
+    # into the store, hence, the node does not own any data.
+    __slots__ = ['store', 'index']
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def ts(self):
+        return TrajectoryStore.ns_to_time_msg(self.store.ts[self.index])
+
+    @property
+    def ts_ns(self):
+        return self.store.ts[self.index]
+
+    @property
+    def id(self):
+        return self.store.ids[self.index]
+
+    @property
+    def robot_name(self):
+        return self.store.robot_name
+
+    @property
+    def position(self):
+        return self.store.positions[self.index]
+
+    @property
+    def orientation(self):
+        return self.store.orientations[self.index]
+
+    @property
+    def residual(self):
+        return self.store.residuals[self.index]
+
+    @property
+    def degenerate(self):
+        return self.store.degenerate[self.index]
+
+
+class TrajectoryChange(object):
+    # Summary of an ingested trajectory. Indices refer to the updated store.
+    def __init__(self, robot_name, n_nodes, new_indices=None, moved_indices=None, relabeled_indices=None, n_removed=0):
+        empty = np.array([], dtype=np.int64)
+        self.robot_name = robot_name
+        self.n_nodes = n_nodes
+        self.new_indices = empty if new_indices is None else new_indices
+        self.moved_indices = empty if moved_indices is None else moved_indices
+        self.relabeled_indices = empty if relabeled_indices is None else relabeled_indices
+        self.n_removed = n_removed
+
+    def has_changes(self):
+        return len(self.new_indices) > 0 or len(self.moved_indices) > 0 \
+            or len(self.relabeled_indices) > 0 or self.n_removed > 0
+
+    def __str__(self):
+        return f'{self.robot_name}: {len(self.new_indices)} new, {len(self.moved_indices)} moved, {len(self.relabeled_indices)} relabeled and {self.n_removed} removed of {self.n_nodes} nodes'
+
+
+class TrajectoryStore(object):
+    # Trajectory of a single robot stored column-wise, i.e. timestamps in ns,
+    # positions (N,3), quaternions (N,4) as [w,x,y,z], submap ids, residuals
+    # and degeneracy flags.
+    def __init__(self, robot_name, ts, positions, orientations, ids=None, residuals=None, degenerate=None):
+        self.robot_name = robot_name
+        self.ts = np.asarray(ts, dtype=np.int64).reshape(-1)
+        n_nodes = self.ts.shape[0]
+        self.positions = np.asarray(
+            positions, dtype=np.float64).reshape(n_nodes, 3)
+        self.orientations = np.asarray(
+            orientations, dtype=np.float64).reshape(n_nodes, 4)
+        self.ids = np.full(n_nodes, -1, dtype=np.int64) if ids is None else np.asarray(
+            ids, dtype=np.int64).reshape(-1)
+        self.residuals = np.zeros(n_nodes) if residuals is None else np.asarray(
+            residuals, dtype=np.float64).reshape(-1)
+        self.degenerate = np.zeros(n_nodes, dtype=bool) if degenerate is None else np.asarray(
+            degenerate, dtype=bool).reshape(-1)
+        self.id_index = None
+
+    @staticmethod
+    def empty(robot_name=''):
+        return TrajectoryStore(robot_name, np.zeros(0), np.zeros((0, 3)), np.zeros((0, 4)))
+
+    @staticmethod
+    def concatenate(stores):
+        return TrajectoryStore(stores[0].robot_name,
+                               np.concatenate([s.ts for s in stores]),
+                               np.concatenate([s.positions for s in stores]),
+                               np.concatenate(
+                                   [s.orientations for s in stores]),
+                               np.concatenate([s.ids for s in stores]),
+                               np.concatenate([s.residuals for s in stores]),
+                               np.concatenate([s.degenerate for s in stores]))
+
+    @staticmethod
+    def ns_to_time_msg(ts_ns):
+        k_ns_per_s = 1000000000
+        ts = Time()
+        ts.sec = int(ts_ns // k_ns_per_s)
+        ts.nanosec = int(ts_ns % k_ns_per_s)
+        return ts
+
+    @staticmethod
+    def time_msg_to_ns(ts):
+        return ts.sec * 1000000000 + ts.nanosec
+
+    def __len__(self):
+        return self.ts.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if key < 0 or key >= len(self):
+                raise IndexError(key)
+            return TrajectoryNodeView(self, key)
+        return self.take(key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield TrajectoryNodeView(self, i)
+
+    def take(self, key):
+        # Slices return views of the columns, index arrays return copies.
+        if not isinstance(key, slice):
+            key = np.asarray(key, dtype=np.int64).reshape(-1)
+        return TrajectoryStore(self.robot_name, self.ts[key], self.positions[key],
+                               self.orientations[key], self.ids[key],
+                               self.residuals[key], self.degenerate[key])
+
+    def get_number_of_submaps(self):
+        if len(self) == 0:
+            return 0
+        return int(self.ids[-1]) + 1
+
+    def get_submap_index(self):
+        # Maps every submap id to a slice if the ids are sorted and
+        # to its indices otherwise.
+        if self.id_index is not None:
+            return self.id_index
+        self.id_index = {}
+        if len(self) == 0:
+            return self.id_index
+        if np.all(np.diff(self.ids) >= 0):
+            unique_ids, starts, counts = np.unique(
+                self.ids, return_index=True, return_counts=True)
+            for id, start, count in zip(unique_ids, starts, counts):
+                self.id_index[int(id)] = slice(int(start), int(start + count))
+        else:
+            order = np.argsort(self.ids, kind='stable')
+            unique_ids, starts = np.unique(
+                self.ids[order], return_index=True)
+            for id, indices in zip(unique_ids, np.split(order, starts[1:])):
+                self.id_index[int(id)] = indices
+        return self.id_index
+
+    def get_range_for_submap(self, id):
+        return self.get_submap_index().get(int(id), slice(0, 0))
+
+    def get_indices_for_submap(self, id):
+        submap_range = self.get_range_for_submap(id)
+        if isinstance(submap_range, slice):
+            return np.arange(submap_range.start, submap_range.stop)
+        return submap_range
+
+    def get_nodes_for_submap(self, id):
+        return self.take(self.get_range_for_submap(id))
+
+    def get_mask_for_submap(self, id):
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.get_range_for_submap(id)] = True
+        return mask
+
+    def get_poses(self):
+        # Rows of [position, orientation, ts] as used by the graphs.
+        return np.column_stack([self.positions, self.orientations, self.ts])
+
+    def compute_trajectory(self):
+        # Rows of [ts, position, orientation].
+        return np.column_stack([self.ts, self.positions, self.orientations])
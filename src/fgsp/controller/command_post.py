@@ -9,11 +9,11 @@ import pickle
 from yaml import serialize
 
 from maplab_msgs.msg import Graph, Trajectory, TrajectoryNode
-from geometry_msgs.msg import PoseStamped
 from nav_msgs.msg import Path
 
 from src.fgsp.common.logger import Logger
 from src.fgsp.common.comms import Comms
+from src.fgsp.common.msg_codec import MsgCodec
 from src.fgsp.common.utils import Utils
 
 
@@ -73,18 +73,6 @@ class CommandPost(object):
     def get_total_amount_of_constraints(self):
         return self.small_constraint_counter + self.mid_constraint_counter + self.large_constraint_counter
 
-    def create_pose_msg_from_node(self, cur_opt):
-        pose_msg = PoseStamped()
-        pose_msg.header.stamp = cur_opt.ts
-        pose_msg.pose.position.x = cur_opt.position[0]
-        pose_msg.pose.position.y = cur_opt.position[1]
-        pose_msg.pose.position.z = cur_opt.position[2]
-        pose_msg.pose.orientation.w = cur_opt.orientation[0]
-        pose_msg.pose.orientation.x = cur_opt.orientation[1]
-        pose_msg.pose.orientation.y = cur_opt.orientation[2]
-        pose_msg.pose.orientation.z = cur_opt.orientation[3]
-        return pose_msg
-
     def send_anchors(self, all_opt_nodes, begin_send, end_send):
         Logger.LogError(
             f'CommandPost: Sending degenerate anchors for {end_send - begin_send} nodes.')
@@ -95,10 +83,9 @@ class CommandPost(object):
         n_constraints = len(indices)
         Logger.LogError(
             f'CommandPost: Sending anchors for {n_constraints} nodes.')
+        self.degenerate_path_msg.poses.extend(
+            MsgCodec.store_to_pose_stamped_msgs(opt_nodes[indices]))
         for i in indices:
-            pose_msg = self.create_pose_msg_from_node(opt_nodes[i])
-            self.degenerate_path_msg.poses.append(pose_msg)
-
             # Update the degenerate anchor indices
             if not i in self.degenerate_indices:
                 self.degenerate_indices.append(i)
@@ -1,35 +1,27 @@
 #! /usr/bin/env python3
 
 import numpy as np
-from liegroups import SE3
-from scipy.spatial.transform import Rotation
-from maplab_msgs.msg import Trajectory, TrajectoryNode
-from geometry_msgs.msg import PoseStamped
 from nav_msgs.msg import Path
-from builtin_interfaces.msg import Time
 
-from src.fgsp.common.utils import Utils
+from src.fgsp.common.lie_utils import LieUtils
 from src.fgsp.common.logger import Logger
 from src.fgsp.common.comms import Comms
-from src.fgsp.common.signal_node import SignalNode
+from src.fgsp.common.msg_codec import MsgCodec
+from src.fgsp.common.trajectory_store import TrajectoryStore, TrajectoryChange
 from src.fgsp.common.visualizer import Visualizer
 
 
 class SignalHandler(object):
     def __init__(self, config):
         self.signals = {}
+        self.changes = {}
         self.config = config
         self.comms = Comms()
 
     def group_robots(self, signals):
-        n_nodes = len(signals)
         grouped_signals = {}
-        for i in range(0, n_nodes):
-            robot = signals[i].robot_name
-            if not robot in grouped_signals.keys():
-                grouped_signals[robot] = []
-
-            grouped_signals[robot].append(signals[i])
+        for node in signals:
+            grouped_signals.setdefault(node.robot_name, []).append(node)
         return grouped_signals
 
     def publish_grouped_robots(self, grouped_signals):
@@ -44,10 +36,10 @@ class SignalHandler(object):
 
     def convert_signal(self, signal_msg):
         grouped_signals = self.group_robots(signal_msg.nodes)
-        self.publish_grouped_robots(grouped_signals)
         Logger.LogInfo(
             f'SignalHandler: Grouped signals are {grouped_signals.keys()}')
 
+        changed_signals = {}
         for key, nodes in grouped_signals.items():
             n_nodes = len(nodes)
             Logger.LogWarn(
@@ -55,13 +47,72 @@ class SignalHandler(object):
             if (n_nodes <= 0):
                 continue
 
-            signals = [None] * n_nodes
-            for i in range(0, n_nodes):
-                signals[i] = self.convert_trajectory_node(nodes[i])
-            self.signals[key] = signals
+            incoming = MsgCodec.trajectory_nodes_to_store(nodes, key)
+            self.changes[key] = self.update_signal(key, incoming)
+            Logger.LogInfo(f'SignalHandler: Changes for {self.changes[key]}.')
+            if self.changes[key].has_changes():
+                changed_signals[key] = nodes
 
+        # Only robots with changes are republished.
+        self.publish_grouped_robots(changed_signals)
         return grouped_signals.keys()
 
+    def update_signal(self, key, incoming):
+        # Matches the incoming nodes to the stored ones by their timestamp and
+        # only takes over the rows that are new or changed.
+        stored = self.signals.get(key)
+        n_nodes = len(incoming)
+        if stored is None or len(stored) == 0:
+            self.signals[key] = incoming
+            return TrajectoryChange(key, n_nodes, new_indices=np.arange(n_nodes))
+
+        order = np.argsort(stored.ts, kind='stable')
+        pos = np.minimum(np.searchsorted(
+            stored.ts[order], incoming.ts), len(stored) - 1)
+        stored_idx = order[pos]
+        matched = stored.ts[stored_idx] == incoming.ts
+
+        moved = matched & self.compute_moved_nodes(
+            stored.take(stored_idx), incoming)
+        relabeled = matched & ~moved & ((stored.ids[stored_idx] != incoming.ids) |
+                                        (stored.residuals[stored_idx] != incoming.residuals))
+        n_removed = len(stored) - len(np.unique(stored_idx[matched]))
+        change = TrajectoryChange(key, n_nodes, np.flatnonzero(~matched), np.flatnonzero(moved),
+                                  np.flatnonzero(relabeled), n_removed)
+        same_order = n_nodes == len(stored) and np.array_equal(
+            stored_idx, np.arange(n_nodes))
+        if not change.has_changes() and same_order:
+            return change
+
+        # Rows are copied on write as other stages might still hold the columns.
+        if same_order:
+            updated = TrajectoryStore.concatenate([stored])
+        elif n_removed == 0 and np.array_equal(stored_idx[0:len(stored)], np.arange(len(stored))):
+            updated = TrajectoryStore.concatenate(
+                [stored, incoming[len(stored):]])
+        else:
+            updated = stored.take(np.where(matched, stored_idx, 0))
+
+        rows = np.flatnonzero(~matched | moved | relabeled)
+        updated.ts[rows] = incoming.ts[rows]
+        updated.positions[rows] = incoming.positions[rows]
+        updated.orientations[rows] = incoming.orientations[rows]
+        updated.ids[rows] = incoming.ids[rows]
+        updated.residuals[rows] = incoming.residuals[rows]
+        updated.degenerate[rows] = incoming.degenerate[rows]
+        self.signals[key] = updated
+        return change
+
+    def compute_moved_nodes(self, lhs, rhs):
+        dist = np.linalg.norm(lhs.positions - rhs.positions, axis=1)
+        dot = np.abs(np.sum(lhs.orientations * rhs.orientations, axis=1))
+        angle = 2.0 * np.arccos(np.clip(dot, 0.0, 1.0))
+        return (dist > self.config.trajectory_change_tolerance_m) | \
+            (angle > self.config.trajectory_change_tolerance_rad)
+
+    def get_changes(self, key):
+        return self.changes.get(key)
+
     def convert_signal_from_path(self, path_msg, robot_name):
         n_poses = len(path_msg.poses)
         if (n_poses <= 0):
@@ -69,110 +120,115 @@ class SignalHandler(object):
 
         # key = path_msg.header.frame_id
         key = robot_name
-        signals = [None] * n_poses
-        for i in range(0, n_poses):
-            signals[i] = self.convert_path_node(path_msg.poses[i], key)
+        n_removed = len(self.get_all_nodes(key))
+        self.signals[key] = MsgCodec.pose_stamped_msgs_to_store(
+            path_msg.poses, key)
+        self.changes[key] = TrajectoryChange(
+            key, n_poses, new_indices=np.arange(n_poses), n_removed=n_removed)
+        return key
+
+    def ingest_signal_from_path(self, path_msg, robot_name):
+        # Only converts the poses that are newer than the last ingested one.
+        # The path is assumed to be ordered by time.
+        pose_msgs = path_msg.poses
+        key = robot_name
+        store = self.signals.get(key)
+        if store is None or len(store) == 0 or len(pose_msgs) == 0:
+            return self.convert_signal_from_path(path_msg, robot_name)
 
-        self.signals[key] = signals
+        n_ingested = self.count_poses_until(pose_msgs, store.ts[-1])
+        if n_ingested != len(store):
+            Logger.LogWarn(
+                f'SignalHandler: Path of {key} changed from {len(store)} to {n_ingested} ingested poses. Reconverting.')
+            return self.convert_signal_from_path(path_msg, robot_name)
+
+        # Compare the most recent ingested poses for upstream rewrites.
+        begin = max(n_ingested - self.config.path_rewrite_window, 0)
+        recent = MsgCodec.pose_stamped_msgs_to_store(
+            pose_msgs[begin:n_ingested], key)
+        changed = self.find_changed_poses(store[begin:], recent)
+        new = MsgCodec.pose_stamped_msgs_to_store(pose_msgs[n_ingested:], key)
+        n_poses = n_ingested + len(new)
+        new_indices = np.arange(n_ingested, n_poses)
+        if len(changed) == 0:
+            if len(new) > 0:
+                self.signals[key] = TrajectoryStore.concatenate([store, new])
+            self.changes[key] = TrajectoryChange(
+                key, n_poses, new_indices=new_indices)
+            return key
+        if begin > 0:
+            # A rewrite within the window might also reach older poses.
+            Logger.LogWarn(
+                f'SignalHandler: Path of {key} was rewritten within the last {len(recent)} poses. Reconverting.')
+            return self.convert_signal_from_path(path_msg, robot_name)
+
+        Logger.LogInfo(
+            f'SignalHandler: Replacing {len(recent)} poses of {key} with {len(changed)} rewritten ones.')
+        self.signals[key] = TrajectoryStore.concatenate(
+            [store[:begin], recent, new])
+        self.changes[key] = TrajectoryChange(
+            key, n_poses, new_indices=new_indices, moved_indices=begin + changed)
         return key
 
+    def count_poses_until(self, pose_msgs, ts_ns):
+        # Binary search for the number of poses not newer than ts_ns.
+        lower, upper = 0, len(pose_msgs)
+        while lower < upper:
+            mid = (lower + upper) // 2
+            if TrajectoryStore.time_msg_to_ns(pose_msgs[mid].header.stamp) <= ts_ns:
+                lower = mid + 1
+            else:
+                upper = mid
+        return lower
+
+    def find_changed_poses(self, lhs, rhs):
+        changed = (lhs.ts != rhs.ts) | (lhs.degenerate != rhs.degenerate) | \
+            np.any(lhs.positions != rhs.positions, axis=1) | \
+            np.any(lhs.orientations != rhs.orientations, axis=1)
+        return np.flatnonzero(changed)
+
     def convert_signal_from_poses(self, poses, robot_name):
         n_poses = len(poses)
         if (n_poses <= 0):
             return ""
 
         key = robot_name
-        signals = [None] * n_poses
-        for i in range(0, n_poses):
-            signals[i] = self.convert_pose(poses[i, :], key)
-
-        self.signals[key] = signals
+        self.signals[key] = self.convert_poses(poses, key)
         return key
 
     def get_all_nodes(self, key):
         if key in self.signals:
             return self.signals[key]
         else:
-            return []
+            return TrajectoryStore.empty(key)
 
     def get_number_of_submaps(self, key):
-        if key in self.signals:
-            return self.signals[key][-1].id + 1
-        else:
-            return 0
+        return self.get_all_nodes(key).get_number_of_submaps()
 
     def get_nodes_for_submap(self, key, id):
-        nodes = self.get_all_nodes(key)
-        filtered_nodes = []
-        for node in nodes:
-            if node.id == id:
-                filtered_nodes.append(node)
-        return filtered_nodes
+        return self.get_all_nodes(key).get_nodes_for_submap(id)
 
     def get_mask_for_submap(self, key, id):
-        nodes = self.get_all_nodes(key)
-        n_nodes = len(nodes)
-        mask = [False] * n_nodes
-        for i in range(0, n_nodes):
-            if nodes[i].id == id:
-                mask[i] = True
-        return mask
+        return self.get_all_nodes(key).get_mask_for_submap(id)
 
     def get_indices_for_submap(self, key, id):
-        nodes = self.get_all_nodes(key)
-        n_nodes = len(nodes)
-        indices = []
-        for i in range(0, n_nodes):
-            if nodes[i].id == id:
-                indices.append(i)
-        return indices
-
-    def convert_trajectory_node(self, node_msg):
-        id = node_msg.id
-        robot_name = node_msg.robot_name
-        pose_msg = node_msg.pose
-        ts = pose_msg.header.stamp
-        position = np.array(
-            [pose_msg.pose.position.x, pose_msg.pose.position.y, pose_msg.pose.position.z])
-        orientation = np.array([pose_msg.pose.orientation.w, pose_msg.pose.orientation.x,
-                               pose_msg.pose.orientation.y, pose_msg.pose.orientation.z])
-        residual = node_msg.signal
-
-        signal = SignalNode()
-        signal.init(ts, id, robot_name, position, orientation, residual)
-        return signal
-
-    def convert_path_node(self, pose_msg, robot_name):
-        ts = pose_msg.header.stamp
-        position = np.array(
-            [pose_msg.pose.position.x, pose_msg.pose.position.y, pose_msg.pose.position.z])
-        orientation = np.array([pose_msg.pose.orientation.w, pose_msg.pose.orientation.x,
-                               pose_msg.pose.orientation.y, pose_msg.pose.orientation.z])
-        degenerate = pose_msg.header.frame_id.lower() == 'degenerate'
-
-        signal = SignalNode()
-        signal.init_onboard(ts, robot_name, position, orientation, degenerate)
-        return signal
-
-    def convert_pose(self, pose, robot_name):
-        id = int(pose[0])
-
-        sec = int(pose[1] // 1)
-        nsec = int((pose[1] - sec) * 1e9)
-        ts = Time()
-        ts.sec = sec
-        ts.nanosec = nsec
-
-        position = pose[2:5]
-        if pose.shape[0] > 5:
-            orientation = pose[5:9]
+        return self.get_all_nodes(key).get_indices_for_submap(id)
+
+    def convert_poses(self, poses, robot_name):
+        # Rows of [id, ts in seconds, position, orientation].
+        poses = np.asarray(poses)
+        ids = poses[:, 0].astype(np.int64)
+        sec = np.floor(poses[:, 1])
+        nsec = ((poses[:, 1] - sec) * 1e9).astype(np.int64)
+        ts = sec.astype(np.int64) * 1000000000 + nsec
+
+        n_poses = poses.shape[0]
+        if poses.shape[1] > 5:
+            orientations = poses[:, 5:9]
         else:
-            orientation = [0, 0, 0, 1]
-        degenerate = False
+            orientations = np.tile([0, 0, 0, 1], (n_poses, 1))
 
-        signal = SignalNode()
-        signal.init(ts, id, robot_name, position, orientation, 0.0, degenerate)
-        return signal
+        return TrajectoryStore(robot_name, ts, poses[:, 2:5], orientations, ids=ids)
 
     def compute_signal_from_key(self, key):
         nodes = self.signals[key]
@@ -194,18 +250,9 @@ class SignalHandler(object):
 
     def compute_so3_signal(self, nodes):
         traj = self.compute_trajectory(nodes)
-        wxyz = traj[0, 4:8]
-        traj_origin = Rotation.from_quat(
-            [wxyz[1], wxyz[2], wxyz[3], wxyz[0]]).as_matrix()
-
-        n_nodes = len(nodes)
-        x_rot = [0] * n_nodes
-        for i in range(0, n_nodes):
-            wxyz = traj[i, 4:8]
-            rot_diff = np.matmul(traj_origin, Rotation.from_quat(
-                [wxyz[1], wxyz[2], wxyz[3], wxyz[0]]).as_matrix().transpose())
-            x_rot[i] = np.trace(rot_diff)
-        return np.array(x_rot)
+        poses = traj[:, 1:8]
+        origin = np.broadcast_to(poses[0, :], poses.shape)
+        return LieUtils.so3_trace_distance(origin, poses)
 
     def compute_signal(self, nodes):
         if self.config.construction_method == 'se3':
@@ -221,67 +268,19 @@ class SignalHandler(object):
 
     def compute_se3_signal(self, nodes):
         traj = self.compute_trajectory(nodes)
-        T_G_origin = Utils.convert_pos_quat_to_transformation(
-            traj[0, 1:4], traj[0, 4:8])
-        pose_origin = SE3.from_matrix(T_G_origin)
-
-        n_nodes = len(nodes)
-        x_se3 = [0] * n_nodes
-        for i in range(0, n_nodes):
-            T_G = Utils.convert_pos_quat_to_transformation(
-                traj[i, 1:4], traj[i, 4:8])
-            pose_cur = SE3.from_matrix(T_G)
-            x_se3[i] = self.compute_se3_distance(pose_origin, pose_cur)
-        return np.array(x_se3)
-
-    def compute_se3_distance(self, pose_lhs, pose_rhs):
-        Xi_12 = (pose_lhs.inv().dot(pose_rhs)).log()
-        W = np.eye(4, 4)
-        W[0, 0] = 10
-        W[1, 1] = 10
-        W[2, 2] = 0.001
-        W[3, 3] = 0.001
-
-        inner = np.trace(
-            np.matmul(np.matmul(SE3.wedge(Xi_12), W), SE3.wedge(Xi_12).transpose()))
-        return np.sqrt(inner)
+        poses = traj[:, 1:8]
+        origin = np.broadcast_to(poses[0, :], poses.shape)
+        return self.compute_se3_distance(origin, poses)
 
-    def compute_trajectory(self, nodes):
-        n_nodes = len(nodes)
-        trajectory = np.zeros((n_nodes, 8))
-        for i in range(n_nodes):
-            trajectory[i, 0] = Utils.ros_time_msg_to_ns(nodes[i].ts)
-            trajectory[i, 1:4] = nodes[i].position
-            trajectory[i, 4:8] = nodes[i].orientation
+    def compute_se3_distance(self, poses_lhs, poses_rhs):
+        Xi_12 = LieUtils.relative_se3_log(poses_lhs, poses_rhs)
+        return LieUtils.weighted_log_norm(Xi_12, [10, 10, 0.001, 0.001])
 
-        return trajectory
+    def compute_trajectory(self, nodes):
+        return nodes.compute_trajectory()
 
     def to_signal_msg(self, key):
-        traj_msg = Trajectory()
-        node_msg = TrajectoryNode()
-        nodes = self.get_all_nodes(key)
-        n_nodes = len(nodes)
-
-        for i in range(n_nodes):
-            node_msg = TrajectoryNode()
-            node_msg.id = nodes[i].id
-            node_msg.robot_name = nodes[i].robot_name
-
-            pose_msg = PoseStamped()
-            pose_msg.header.stamp = nodes[i].ts
-            pose_msg.pose.position.x = nodes[i].position[0]
-            pose_msg.pose.position.y = nodes[i].position[1]
-            pose_msg.pose.position.z = nodes[i].position[2]
-            pose_msg.pose.orientation.w = nodes[i].orientation[0]
-            pose_msg.pose.orientation.x = nodes[i].orientation[1]
-            pose_msg.pose.orientation.y = nodes[i].orientation[2]
-            pose_msg.pose.orientation.z = nodes[i].orientation[3]
-
-            node_msg.pose = pose_msg
-            node_msg.signal = nodes[i].residual
-            traj_msg.nodes.append(node_msg)
-
-        return traj_msg
+        return MsgCodec.store_to_trajectory_msg(self.get_all_nodes(key))
 
     def publish(self):
         topic_fmt = '/graph_monitor/signal/{key}_trajectory'
@@ -290,32 +289,22 @@ class SignalHandler(object):
         for robot, nodes in self.signals.items():
             Logger.LogWarn(f'SignalHandler: Publishing signal for {robot}')
             topic = topic_fmt.format(key=robot)
-            for node in nodes:
-                viz.add_signal_coordinate(node.position, color_idx)
+            for position in nodes.positions:
+                viz.add_signal_coordinate(position, color_idx)
             viz.visualize_signals(topic)
             viz.resetConstraintVisualization()
             color_idx += 1
 
-    def marginalize_signal(self, signal, indices, n_nodes):
-        n_indices = len(indices)
-        if n_indices < 2:
+    def marginalize_signal(self, signal, clusters):
+        # Sums the signal of all nodes within the same cluster.
+        n_clusters = np.max(clusters) + 1 if len(clusters) > 0 else 0
+        if n_clusters < 2:
             return signal
-
-        # Marginalize all intermediate signals
-        marginalized = np.zeros(n_indices)
-        for idx in range(1, n_indices):
-            for i in range(indices[idx-1], indices[idx]):
-                marginalized[idx-1] += signal[i]
-                # marginalized[idx-1] = max(marginalized[idx-1], signal[i])
-
-        # Marginalize remaining signals
-        last_reduced_idx = n_indices - 1
-        for i in range(indices[last_reduced_idx], n_nodes):
-            marginalized[last_reduced_idx] += signal[i]
-            # marginalized[last_reduced_idx] = max(
-            # marginalized[last_reduced_idx], signal[i])
-
-        return marginalized
+        n_nodes = min(len(signal), len(clusters))
+        if len(signal) != len(clusters):
+            Logger.LogError(
+                f'SignalHandler: Signal has {len(signal)} nodes but the hierarchy has {len(clusters)}. Marginalizing the first {n_nodes}.')
+        return np.bincount(clusters[0:n_nodes], weights=signal[0:n_nodes], minlength=n_clusters)
 
 
 if __name__ == '__main__':
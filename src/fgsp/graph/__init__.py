@@ -1,3 +1,8 @@
 from .global_graph import GlobalGraph
 from .hierarchical_graph import HierarchicalGraph
 from .base_graph import BaseGraph
+from .construction_pool import ConstructionPool
+from .spectral_cache import SpectralCache
+from .graph_coarsening import GraphCoarsening
+from .lazy_graph import LazyGraph
+from .graph_metrics import GraphMetrics
@@ -1,78 +1,155 @@
 #! /usr/bin/env python3
 
-import multiprocessing
 import numpy as np
-from liegroups import SE3
-from scipy import spatial
-from functools import partial
-from multiprocessing import Pool
+from scipy import sparse, spatial
+from scipy.sparse import linalg
+from scipy.linalg import qr as linalg_qr
 
-from src.fgsp.common.utils import Utils
+from src.fgsp.common.lie_utils import LieUtils
 from src.fgsp.common.logger import Logger
 from src.fgsp.common.config import ClientConfig
-
-
-def process_poses(poses, tree, w_func, i):
-    if len(poses) == 0:
-        return
-    max_pos_dist = 6.0
-    nn_indices = tree.query_ball_point(
-        poses[i, 0:3], r=max_pos_dist, p=2)
-
-    return nn_indices, [w_func(poses[i, :], poses[nn_i, :]) for nn_i in nn_indices]
-
-
-def compute_distance_weights(coords_lhs, coords_rhs):
+from src.fgsp.graph.spectral_solver import SpectralSolver
+from src.fgsp.graph.lazy_graph import LazyGraph
+from src.fgsp.graph.graph_metrics import GraphMetrics
+
+
+def compute_neighbor_pairs(poses, max_pos_dist=6.0):
+    # Returns each pair (i, j) with i < j within the ball exactly once.
+    tree = spatial.cKDTree(poses[:, 0:3])
+    return tree.query_pairs(r=max_pos_dist, p=2, output_type='ndarray')
+
+
+def compute_mutual_knn_pairs(poses, k, max_pos_dist=6.0):
+    # Returns each pair (i, j) with i < j where both are among the k nearest
+    # neighbors of each other within the ball. The degree is bounded by k.
+    n_poses = poses.shape[0]
+    if n_poses <= 1 or k <= 0:
+        return np.zeros((0, 2), dtype=int)
+    k = min(k, n_poses - 1)
+    tree = spatial.cKDTree(poses[:, 0:3])
+    _, nn_indices = tree.query(
+        poses[:, 0:3], k=k+1, p=2, distance_upper_bound=max_pos_dist)
+
+    # Missing neighbors are reported with index n_poses.
+    rows = np.repeat(np.arange(n_poses), k+1)
+    cols = nn_indices.reshape(-1)
+    valid = np.logical_and(cols < n_poses, rows != cols)
+    rows = rows[valid]
+    cols = cols[valid]
+
+    keys = rows * n_poses + cols
+    mutual = np.isin(cols * n_poses + rows, keys)
+    upper = rows < cols
+    mask = np.logical_and(mutual, upper)
+    return np.column_stack([rows[mask], cols[mask]])
+
+
+def compute_neighbor_pairs_for(poses, indices, max_pos_dist=6.0):
+    # Returns all pairs (i, j) with i in indices and i != j within the ball.
+    tree = spatial.cKDTree(poses[:, 0:3])
+    nn_indices = tree.query_ball_point(poses[indices, 0:3], r=max_pos_dist, p=2)
+    n_neighbors = np.fromiter(
+        (len(nn) for nn in nn_indices), dtype=int, count=len(indices))
+    if np.sum(n_neighbors) == 0:
+        return np.zeros((0, 2), dtype=int)
+    rows = np.repeat(indices, n_neighbors)
+    cols = np.concatenate([nn for nn in nn_indices if len(nn) > 0])
+    pairs = np.column_stack([rows, cols])
+    return pairs[rows != cols]
+
+
+def compute_k_hop_neighborhood(adj, indices, n_hops):
+    # Returns the sorted nodes within n_hops edges of the given indices.
+    reachable = sparse.csr_matrix(adj, dtype=bool)
+    mask = np.zeros(adj.shape[0], dtype=bool)
+    mask[indices] = True
+    for _ in range(n_hops):
+        frontier = reachable.dot(mask)
+        if np.all(mask[frontier]):
+            break
+        mask |= frontier
+    return np.flatnonzero(mask)
+
+
+def compute_kron_reduction(L, indices, tol=1e-10, block_size=256):
+    # Schur complement L_kk - L_ke * inv(L_ee) * L_ek of the eliminated
+    # nodes using a sparse LU factorization of L_ee. Returns the sparse
+    # weights of the reduced graph.
+    L = sparse.csr_matrix(L)
+    indices = np.asarray(indices, dtype=int)
+    complement = np.setdiff1d(np.arange(L.shape[0]), indices)
+    L_kept = L[indices, :]
+    L_red = L_kept[:, indices]
+
+    if complement.size > 0:
+        L_elim = L[complement, :]
+        L_ek = L_elim[:, indices].tocsc()
+        L_ee = L_elim[:, complement].tocsc()
+
+        # The small shift grounds eliminated components without kept nodes.
+        shift = tol * max(np.max(np.abs(L_ee.diagonal())), 1.0)
+        lu = linalg.splu(
+            L_ee + shift * sparse.identity(complement.size, format='csc'))
+
+        # Solve only for the kept nodes adjacent to eliminated ones.
+        cols = np.flatnonzero(np.diff(L_ek.indptr))
+        rows, cols_nz, data = [], [], []
+        for start in range(0, cols.size, block_size):
+            block = cols[start:start+block_size]
+            X = lu.solve(L_ek[:, block].toarray())
+            r, c = np.nonzero(np.abs(X) > tol * np.max(np.abs(X)))
+            rows.append(r)
+            cols_nz.append(block[c])
+            data.append(X[r, c])
+        if cols.size > 0:
+            X = sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols_nz))),
+                                  shape=(complement.size, indices.size))
+            L_red = L_red - L_kept[:, complement].dot(X)
+
+    L_red = 0.5 * (L_red + L_red.T)
+    W = sparse.csr_matrix(-L_red)
+    W.setdiag(0)
+    if W.nnz > 0:
+        W.data[W.data <= tol * np.max(np.abs(W.data))] = 0
+    W.eliminate_zeros()
+    return W
+
+
+def compute_distance_weights_batch(poses_lhs, poses_rhs):
     sigma = 1.0
     normalization = 2.0*(sigma**2)
-    dist = spatial.distance.euclidean(coords_lhs[0:3], coords_rhs[0:3])
+    dist = np.linalg.norm(poses_lhs[:, 0:3] - poses_rhs[:, 0:3], axis=1)
 
     return np.exp(-dist/normalization)
 
 
-def compute_so3_weights(pose_lhs, pose_rhs):
-    R_lhs = Utils.convert_quat_to_rotation(pose_lhs[3:7])
-    R_rhs = Utils.convert_quat_to_rotation(pose_rhs[3:7])
-    rot_diff = np.matmul(R_lhs, R_rhs.transpose())
-    return np.trace(rot_diff)
-
-
-def compute_se3_weights(poses_lhs, poses_rhs):
-    T_G_lhs = Utils.convert_pos_quat_to_transformation(
-        poses_lhs[0:3], poses_lhs[3:7])
-    T_G_rhs = Utils.convert_pos_quat_to_transformation(
-        poses_rhs[0:3], poses_rhs[3:7])
-
-    pose1 = SE3.from_matrix(T_G_lhs)
-    pose2 = SE3.from_matrix(T_G_rhs)
+def compute_so3_weights_batch(poses_lhs, poses_rhs):
+    return LieUtils.so3_trace_distance(poses_lhs, poses_rhs)
 
-    Xi_12 = (pose1.inv().dot(pose2)).log()
-    W = np.eye(4, 4)
-    W[0, 0] = 1
-    W[1, 1] = 1
-    W[2, 2] = 1
-    W[3, 3] = 1
-    inner = np.trace(
-        np.matmul(np.matmul(SE3.wedge(Xi_12), W), SE3.wedge(Xi_12).transpose()))
 
-    # Equal weighting for rotation and translation.
-    # inner = np.matmul(Xi_12.transpose(),Xi_12)
-
-    dist = np.sqrt(inner)
+def compute_se3_weights_batch(poses_lhs, poses_rhs):
+    Xi_12 = LieUtils.relative_se3_log(poses_lhs, poses_rhs)
+    dist = LieUtils.weighted_log_norm(Xi_12, [1, 1, 1, 1])
     sigma = 1.0
     normalization = 2.0*(sigma**2)
     return np.exp(-dist/normalization)
 
 
 class BaseGraph(object):
-    def __init__(self, config):
+    def __init__(self, config, pool=None, cache=None):
         if config is None:
             config = ClientConfig()
         self.config = config
+        self.pool = pool
+        self.spectral_solver = SpectralSolver(config, cache)
         self.is_built = False
         self.graph_seq = -1
         self.latest_graph_msg = None
 
+        # Poses and adjacency of the last construction for incremental updates.
+        self.construction_poses = None
+        self.construction_adj = None
+
     def build(self, graph_msg):
         Logger.LogFatal('Called method in BaseGraph')
 
@@ -93,70 +170,228 @@ class BaseGraph(object):
 
     def create_adjacency_from_poses(self, poses):
         n_coords = poses.shape[0]
-        n_dims = poses.shape[1]
-        adj = np.zeros((n_coords, n_coords))
-        tree = spatial.KDTree(poses[:, 0:3])
+        if n_coords == 0:
+            return sparse.csr_matrix((n_coords, n_coords))
+
+        w_func = self.select_weight_function(poses.shape[1])
+        pairs = self.compute_neighbor_pairs(poses)
+        weights = np.absolute(
+            self.compute_pair_weights(poses, pairs, w_func))
+        assert np.all(weights >= 0)
+        return self.create_sparse_adjacency(n_coords, pairs, weights)
+
+    def update_adjacency_from_poses(self, poses):
+        if not self.config.use_incremental_construction:
+            return self.create_adjacency_from_poses(poses)
+
+        dirty = self.find_dirty_nodes(poses)
+        n_coords = poses.shape[0]
+        if dirty is None or len(dirty) > 0.5 * n_coords:
+            adj = self.create_adjacency_from_poses(poses)
+            self.construction_poses = np.copy(poses)
+        else:
+            Logger.LogDebug(
+                f'BaseGraph: Incrementally updating {len(dirty)}/{n_coords} nodes.')
+            adj = self.patch_adjacency(poses, dirty)
+
+            # Clean rows keep the pose their edges were computed from such
+            # that small drifts accumulate until the node becomes dirty.
+            construction_poses = np.empty_like(poses)
+            n_prev = self.construction_poses.shape[0]
+            construction_poses[0:n_prev] = self.construction_poses
+            construction_poses[dirty] = poses[dirty]
+            self.construction_poses = construction_poses
+
+        self.construction_adj = adj
+        return adj
+
+    def find_dirty_nodes(self, poses):
+        prev_poses = self.construction_poses
+        if prev_poses is None or self.construction_adj is None:
+            return None
+        n_prev = prev_poses.shape[0]
+        n_coords = poses.shape[0]
+        if n_coords < n_prev or poses.shape[1] != prev_poses.shape[1]:
+            return None
+
+        # Column 7 holds the timestamps which identify the nodes.
+        if poses.shape[1] > 7 and not np.array_equal(poses[0:n_prev, 7], prev_poses[:, 7]):
+            return None
 
-        indices = np.arange(0, n_coords)
+        n_cols = min(poses.shape[1], 7)
+        diff = np.linalg.norm(
+            poses[0:n_prev, 0:n_cols] - prev_poses[:, 0:n_cols], axis=1)
+        moved = np.where(diff > self.config.incremental_pose_tolerance)[0]
+        return np.concatenate([moved, np.arange(n_prev, n_coords)])
 
+    def patch_adjacency(self, poses, dirty):
+        n_coords = poses.shape[0]
+        n_prev = self.construction_poses.shape[0]
+        is_dirty = np.zeros(n_coords, dtype=bool)
+        is_dirty[dirty] = True
+        if self.config.neighborhood_method == 'mutual_knn':
+            return self.patch_knn_adjacency(poses, is_dirty)
+
+        # Keep all edges between unchanged nodes.
+        keep = sparse.diags(np.logical_not(is_dirty).astype(float))
+        prev_adj = self.construction_adj.tocsr(copy=True)
+        prev_adj.resize((n_coords, n_coords))
+        adj = keep @ prev_adj @ keep
+
+        # Recompute all edges touching a dirty node exactly once.
+        pairs = compute_neighbor_pairs_for(
+            poses, dirty, self.config.neighborhood_radius)
+        unique = np.logical_or(np.logical_not(
+            is_dirty[pairs[:, 1]]), pairs[:, 0] < pairs[:, 1])
+        pairs = pairs[unique]
+
+        w_func = self.select_weight_function(poses.shape[1])
+        weights = np.absolute(
+            self.compute_pair_weights(poses, pairs, w_func))
+        adj = adj + self.create_sparse_adjacency(n_coords, pairs, weights)
+        return adj.tocsr()
+
+    def patch_knn_adjacency(self, poses, is_dirty):
+        # New nodes can evict neighbors of unchanged nodes, hence the pairs
+        # are always recomputed but weights of unchanged pairs are reused.
+        pairs = self.compute_neighbor_pairs(poses)
+        clean = np.logical_not(np.logical_or(
+            is_dirty[pairs[:, 0]], is_dirty[pairs[:, 1]]))
+        weights = np.zeros(pairs.shape[0])
+        weights[clean] = np.asarray(
+            self.construction_adj[pairs[clean, 0], pairs[clean, 1]]).reshape(-1)
+
+        compute = weights == 0
+        w_func = self.select_weight_function(poses.shape[1])
+        weights[compute] = np.absolute(
+            self.compute_pair_weights(poses, pairs[compute], w_func))
+        return self.create_sparse_adjacency(poses.shape[0], pairs, weights)
+
+    def compute_neighbor_pairs(self, poses):
+        if self.config.neighborhood_method == 'mutual_knn':
+            return compute_mutual_knn_pairs(
+                poses, self.config.neighborhood_max_degree, self.config.neighborhood_radius)
+        elif self.config.neighborhood_method != 'radius':
+            Logger.LogError(
+                f'Unknown neighborhood method ({self.config.neighborhood_method}). Using radius search.')
+        return compute_neighbor_pairs(poses, self.config.neighborhood_radius)
+
+    def select_weight_function(self, n_dims):
         if self.config.construction_method == 'se3' and n_dims >= 7:
-            func = partial(process_poses, poses, tree, compute_se3_weights)
+            w_func = compute_se3_weights_batch
         elif self.config.construction_method == 'so3' and n_dims >= 7:
-            func = partial(process_poses, poses, tree, compute_so3_weights)
+            w_func = compute_so3_weights_batch
         elif self.config.construction_method == 'r3':
-            func = partial(process_poses, poses, tree,
-                           compute_distance_weights)
+            w_func = compute_distance_weights_batch
         else:
             Logger.LogError(
                 f'Unknown construction method ({self.config.construction_method}) or not enough dimensions ({n_dims}) . Using position only.')
-            func = partial(process_poses, poses, tree,
-                           compute_distance_weights)
-
-        n_cores = multiprocessing.cpu_count() if self.config.use_parallel_construction else 1
-        with Pool(n_cores) as p:
-            for idx, (nn_indices, weights) in zip(indices, p.map(func, indices)):
-                for nn_i, w in zip(nn_indices, weights):
-                    if nn_i != idx:
-                        adj[idx, nn_i] = w
-                        adj[nn_i, idx] = w
-
-        adj = np.absolute(adj)
-        assert np.all(adj >= 0)
+            w_func = compute_distance_weights_batch
+        return w_func
+
+    def create_sparse_adjacency(self, n_coords, pairs, weights):
+        rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        adj = sparse.csr_matrix(
+            (np.concatenate([weights, weights]), (rows, cols)), shape=(n_coords, n_coords))
+        adj.eliminate_zeros()
         return adj
 
+    def compute_pair_weights(self, poses, pairs, w_func):
+        if pairs.shape[0] == 0:
+            return np.zeros(0)
+        if self.pool is None:
+            return w_func(poses[pairs[:, 0]], poses[pairs[:, 1]])
+        return self.pool.compute_weights(poses, pairs, w_func)
+
+    def kron_reduction(self, G, indices):
+        W = compute_kron_reduction(G.L, indices)
+        coords = G.coords[indices, :] if len(G.coords.shape) else None
+        return LazyGraph(W, coords=coords)
+
+    def compute_dirichlet_ratio(self, x1, x2):
+        G = self.get_graph()
+        return GraphMetrics.compute_ratio(
+            GraphMetrics.dirichlet_energy(G, x1), GraphMetrics.dirichlet_energy(G, x2))
+
+    def compute_total_variation_ratio(self, x1, x2):
+        G = self.get_graph()
+        return GraphMetrics.compute_ratio(
+            GraphMetrics.total_variation(G, x1), GraphMetrics.total_variation(G, x2))
+
+    def compute_total_variation(self, x):
+        return GraphMetrics.total_variation(self.get_graph(), x)
+
+    def compute_average_local_variation(self, x1, x2):
+        return GraphMetrics.average_local_variation(self.get_graph(), x1, x2)
+
+    def requires_fourier_basis(self):
+        # The client only uses the spectrum in the multiscale mode.
+        return not isinstance(self.config, ClientConfig) or self.config.client_mode == 'multiscale'
+
     def reduce_every_other(self, coords):
         n_nodes = coords.shape[0]
         return np.arange(0, n_nodes, 2)
 
     def reduce_largest_ev_positive(self, take_n, G):
-        idx = np.argmax(np.abs(G.U))
-        _, idx_fourier = np.unravel_index(idx, G.U.shape)
-        indices = []
-        for i in range(0, take_n):
-            if (G.U[i, idx_fourier] >= 0):
-                indices.append(i)
-        return indices
+        idx_fourier = self.find_largest_ev_column(G.U)
+        return np.flatnonzero(G.U[:take_n, idx_fourier] >= 0).tolist()
 
     def reduce_largest_ev_negative(self, take_n, G):
-        idx = np.argmax(np.abs(G.U))
-        _, idx_fourier = np.unravel_index(idx, G.U.shape)
-        indices = []
-        for i in range(0, take_n):
-            if (G.U[i, idx_fourier] < 0):
-                indices.append(i)
-        return indices
+        idx_fourier = self.find_largest_ev_column(G.U)
+        return np.flatnonzero(G.U[:take_n, idx_fourier] < 0).tolist()
+
+    def find_largest_ev_column(self, U):
+        idx = np.argmax(np.abs(U))
+        _, idx_fourier = np.unravel_index(idx, U.shape)
+        return idx_fourier
 
     def reduce_largest_ev(self, take_n, G):
         Logger.LogInfo(f'BaseGraph: Reducing to largest {take_n} EVs')
-        indices = []
-        ev = np.abs(G.U)
-        for i in range(0, take_n):
-            idx = np.argmax(ev)
-            idx_vertex, idx_fourier = np.unravel_index(idx, G.U.shape)
-            if ev[idx_vertex, idx_fourier] == -1:
-                Logger.LogWarn(
-                    f'BaseGraph: Could not reduce to requested number of nodes: {len(indices)}/{take_n}')
-                return indices
-            ev[idx_vertex, :] = -1
-            indices.append(idx_vertex)
-        return indices
+        # Picks the vertices in descending order of their largest absolute
+        # eigenvector entry. Ties are resolved by the lower vertex index.
+        row_max = np.max(np.abs(G.U), axis=1)
+        n_nodes = row_max.shape[0]
+        if take_n > n_nodes:
+            Logger.LogWarn(
+                f'BaseGraph: Could not reduce to requested number of nodes: {n_nodes}/{take_n}')
+            take_n = n_nodes
+        if take_n <= 0:
+            return []
+        threshold = -np.partition(-row_max, take_n - 1)[take_n - 1]
+        candidates = np.flatnonzero(row_max >= threshold)
+        order = np.lexsort((candidates, -row_max[candidates]))
+        return candidates[order][:take_n].tolist()
+
+    def reduce_bandlimited_sampling(self, take_n, G):
+        Logger.LogInfo(
+            f'BaseGraph: Reducing to {take_n} nodes using bandlimited sampling')
+        # Greedily picks the nodes that maximize the volume spanned by their
+        # rows of the band-limited basis, i.e. a column pivoted QR of U_K^T.
+        U = self.get_bandlimited_basis(take_n, G)
+        n_bandwidth = min(U.shape[1], take_n)
+        _, _, pivots = linalg_qr(
+            U[:, :n_bandwidth].T, mode='economic', pivoting=True)
+        samples = pivots[:n_bandwidth]
+        if take_n > n_bandwidth:
+            # The pivots beyond K are arbitrary, hence, the remaining nodes
+            # are taken by their leverage score in the band.
+            leverage = np.sum(U ** 2, axis=1)
+            leverage[samples] = -np.inf
+            order = np.argsort(-leverage, kind='stable')
+            samples = np.concatenate([samples, order[:take_n - n_bandwidth]])
+        return np.sort(samples).tolist()
+
+    def get_bandlimited_basis(self, take_n, G):
+        # The bandwidth is capped by the configured number of eigenvectors
+        # and an existing low frequency basis is reused as it is.
+        U = getattr(G, '_U', None)
+        if U is not None and self.spectral_solver.method != 'band':
+            return U[:, :min(take_n, U.shape[1])]
+        bandwidth = min(take_n, self.spectral_solver.n_eigenvectors)
+        L = sparse.csc_matrix(G.L)
+        if bandwidth >= G.N - 1:
+            _, U = np.linalg.eigh(L.toarray())
+            return U[:, :bandwidth]
+        _, U = self.spectral_solver.compute_smallest_eigenpairs(L, bandwidth)
+        return U
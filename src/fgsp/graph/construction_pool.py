@@ -0,0 +1,104 @@
+#! /usr/bin/env python3
+
+import multiprocessing
+import numpy as np
+from multiprocessing import Pool, resource_tracker, shared_memory
+
+from src.fgsp.common.logger import Logger
+
+# Shared block the current worker process is attached to.
+_worker_block = None
+
+
+def attach_shared_block(name):
+    global _worker_block
+    if _worker_block is None or _worker_block.name != name:
+        if _worker_block is not None:
+            _worker_block.close()
+        _worker_block = shared_memory.SharedMemory(name=name)
+    return _worker_block
+
+
+def process_pair_chunk(name, n_poses, n_dims, n_pairs, w_func, begin, end):
+    block = attach_shared_block(name)
+    poses, pairs, weights = ConstructionPool.map_block(
+        block.buf, n_poses, n_dims, n_pairs)
+    chunk = pairs[begin:end]
+    weights[begin:end] = w_func(poses[chunk[:, 0]], poses[chunk[:, 1]])
+    return end - begin
+
+
+class ConstructionPool(object):
+    def __init__(self, n_workers=1):
+        if n_workers < 0:
+            n_workers = multiprocessing.cpu_count()
+        self.n_workers = max(n_workers, 1)
+
+        # Workers must share our resource tracker, otherwise each of them
+        # would try to clean up the shared block on exit.
+        resource_tracker.ensure_running()
+        self.pool = Pool(self.n_workers) if self.n_workers > 1 else None
+        self.block = None
+        Logger.LogInfo(
+            f'ConstructionPool: Initialized with {self.n_workers} workers.')
+
+    def is_parallel(self):
+        return self.pool is not None
+
+    def compute_weights(self, poses, pairs, w_func):
+        n_pairs = pairs.shape[0]
+        if not self.is_parallel() or n_pairs < self.n_workers:
+            return w_func(poses[pairs[:, 0]], poses[pairs[:, 1]])
+
+        n_poses, n_dims = poses.shape
+        self.reserve_block(8 * (n_poses * n_dims + 3 * n_pairs))
+        shm_poses, shm_pairs, shm_weights = self.map_block(
+            self.block.buf, n_poses, n_dims, n_pairs)
+        shm_poses[:] = poses
+        shm_pairs[:] = pairs
+
+        # Workers only receive the block name and their pair range.
+        bounds = np.linspace(0, n_pairs, self.n_workers + 1, dtype=int)
+        tasks = [(self.block.name, n_poses, n_dims, n_pairs, w_func, bounds[i], bounds[i+1])
+                 for i in range(self.n_workers)]
+        self.pool.starmap(process_pair_chunk, tasks)
+
+        weights = shm_weights.copy()
+        del shm_poses, shm_pairs, shm_weights
+        return weights
+
+    def reserve_block(self, n_bytes):
+        if self.block is not None and self.block.size >= n_bytes:
+            return
+        self.release_block()
+
+        # Over-allocate so that a growing trajectory does not reallocate every tick.
+        self.block = shared_memory.SharedMemory(
+            create=True, size=max(int(1.5 * n_bytes), 1))
+        Logger.LogDebug(
+            f'ConstructionPool: Reserved shared block of {self.block.size} bytes.')
+
+    def release_block(self):
+        if self.block is None:
+            return
+        self.block.close()
+        self.block.unlink()
+        self.block = None
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.release_block()
+
+    @staticmethod
+    def map_block(buf, n_poses, n_dims, n_pairs):
+        # Layout: poses (float64), pairs (int64), weights (float64).
+        n_pose_values = n_poses * n_dims
+        poses = np.ndarray((n_poses, n_dims), dtype=np.float64, buffer=buf)
+        pairs = np.ndarray((n_pairs, 2), dtype=np.int64,
+                           buffer=buf, offset=8 * n_pose_values)
+        weights = np.ndarray((n_pairs,), dtype=np.float64,
+                             buffer=buf, offset=8 * (n_pose_values + 2 * n_pairs))
+        return poses, pairs, weights
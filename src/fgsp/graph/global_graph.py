@@ -2,25 +2,26 @@
 import time
 
 import numpy as np
-from scipy import spatial
+from scipy import sparse, spatial
 from maplab_msgs.msg import Graph
-from geometry_msgs.msg import Point
-from pygsp import graphs, filters, reduction, utils
+from pygsp import utils
 from functools import partial
 from multiprocessing import Pool
 from liegroups import SE3
 
 from src.fgsp.common.logger import Logger
+from src.fgsp.common.msg_codec import MsgCodec
 from src.fgsp.common.utils import Utils
 from src.fgsp.common.visualizer import Visualizer
 from src.fgsp.graph.base_graph import BaseGraph
+from src.fgsp.graph.lazy_graph import LazyGraph
 from src.fgsp.common.utils import Utils
 from src.fgsp.common.visualizer import Visualizer
 
 
 class GlobalGraph(BaseGraph):
-    def __init__(self, config, reduced=False):
-        BaseGraph.__init__(self, config)
+    def __init__(self, config, reduced=False, pool=None, cache=None):
+        BaseGraph.__init__(self, config, pool, cache)
         self.adj = None
         self.coords = np.array([])
         self.G = None
@@ -58,7 +59,7 @@ class GlobalGraph(BaseGraph):
         Logger.LogDebug(
             f'GlobalGraph: Building with ind: {len(self.submap_ind)}.')
 
-        self.adj = utils.symmetrize(self.adj, method='average')
+        self.adj = utils.symmetrize(self.adj, method='average').tocsr()
         if not self.build_graph():
             self.G = None
             self.is_built = False
@@ -75,11 +76,11 @@ class GlobalGraph(BaseGraph):
         self.latest_graph_msg = graph_msg
 
     def build_graph(self):
-        if len(self.adj.tolist()) == 0:
+        if self.adj.shape[0] == 0:
             Logger.LogInfo(
                 'GlobalGraph: Path adjacency matrix is empty. Aborting graph building.')
             return False
-        self.G = graphs.Graph(self.adj)
+        self.G = LazyGraph(self.adj)
 
         if self.G.N != self.coords.shape[0]:
             Logger.LogError(
@@ -91,7 +92,9 @@ class GlobalGraph(BaseGraph):
             return False
 
         self.G.set_coordinates(self.coords[:, [0, 1]])
-        self.G.compute_fourier_basis()
+        if self.requires_fourier_basis():
+            self.spectral_solver.compute_fourier_basis(
+                self.G, warm_start=True)
 
         if (self.is_reduced):
             self.reduce_graph()
@@ -101,7 +104,7 @@ class GlobalGraph(BaseGraph):
 
     def build_graph_from_coords_and_adj(self, coords, adj):
         self.coords = coords
-        self.adj = adj
+        self.adj = sparse.csr_matrix(adj)
         self.build_graph()
 
     def build_from_path(self, path_msg):
@@ -128,7 +131,7 @@ class GlobalGraph(BaseGraph):
         self.coords = poses
         Logger.LogDebug(
             f'GlobalGraph Building with coords {self.coords.shape}.')
-        self.adj = self.create_adjacency_from_poses(poses)
+        self.adj = self.update_adjacency_from_poses(poses)
         Logger.LogDebug(f'GlobalGraph: Building with adj: {self.adj.shape}.')
         return self.build_graph()
 
@@ -148,37 +151,13 @@ class GlobalGraph(BaseGraph):
         return len(self.skip_ind) > 0
 
     def read_coordinates(self, graph_msg):
-        n_coords = len(graph_msg.coords)
-        coords = np.zeros((n_coords, 3))
-        for i in range(n_coords):
-            coords[i, 0] = graph_msg.coords[i].x
-            coords[i, 1] = graph_msg.coords[i].y
-            coords[i, 2] = graph_msg.coords[i].z
-
-        return coords
+        return MsgCodec.read_graph_coords(graph_msg)
 
     def read_coordinates_from_poses(self, poses):
-        n_coords = len(poses)
-        coords = np.zeros((n_coords, 8))
-        for i in range(0, n_coords):
-            coords[i, 0] = poses[i].pose.position.x
-            coords[i, 1] = poses[i].pose.position.y
-            coords[i, 2] = poses[i].pose.position.z
-            coords[i, 3] = poses[i].pose.orientation.x
-            coords[i, 4] = poses[i].pose.orientation.y
-            coords[i, 5] = poses[i].pose.orientation.z
-            coords[i, 6] = poses[i].pose.orientation.w
-            coords[i, 7] = Utils.ros_time_msg_to_ns(poses[i].pose.header.stamp)
-        return coords
+        return MsgCodec.read_pose_stamped_msgs(poses)
 
     def read_adjacency(self, graph_msg):
-        n_coords = len(graph_msg.coords)
-        adj = np.zeros((n_coords, n_coords))
-        for i in range(n_coords):
-            for j in range(n_coords):
-                adj[i, j] = graph_msg.adjacency_matrix[j + i * n_coords]
-
-        return adj
+        return sparse.csr_matrix(MsgCodec.read_graph_adjacency(graph_msg))
 
     def get_graph(self):
         return self.G
@@ -205,7 +184,7 @@ class GlobalGraph(BaseGraph):
         elif self.config.reduction_method == 'negative_ev':
             self.reduced_ind = self.reduce_largest_ev_negative(
                 self.G.N, self.G)
-        elif self.config.reduction_method == 'largest_ev':
+        elif self.config.reduction_method in ['largest_ev', 'bandlimited_sampling']:
             take_n = int(round(self.config.reduce_to_n_percent * self.G.N))
             if take_n >= self.G.N:
                 Logger.LogWarn(
@@ -213,7 +192,11 @@ class GlobalGraph(BaseGraph):
                 print(take_n)
                 print(self.G.N)
                 return
-            self.reduced_ind = self.reduce_largest_ev(take_n)
+            if self.config.reduction_method == 'largest_ev':
+                self.reduced_ind = self.reduce_largest_ev(take_n, self.G)
+            else:
+                self.reduced_ind = self.reduce_bandlimited_sampling(
+                    take_n, self.G)
         else:
             Logger.LogError(
                 f'GlobalGraph: Unknown graph reduction method: {self.config.reduction_method}. Aborting reduction.')
@@ -224,32 +207,18 @@ class GlobalGraph(BaseGraph):
         Logger.LogInfo(
             f'GlobalGraph: Reducing graph using {len(reduced_ind)}/{self.G.N} indices.')
         self.coords = self.coords[reduced_ind]
-        self.G = reduction.kron_reduction(self.G, reduced_ind)
-        self.adj = self.G.W.toarray()
-
-        # TODO(lbern): check why kron results in some negative weights sometimes.
-        # self.adj[self.adj < 0] = 0
-        # self.G = graphs.Graph(self.adj)
-
-        assert np.all(self.adj >= 0)
-        self.G.compute_fourier_basis()
+        self.G = self.kron_reduction(self.G, reduced_ind)
+        self.adj = sparse.csr_matrix(self.G.W)
+        assert np.all(self.adj.data >= 0)
+        self.spectral_solver.compute_fourier_basis(self.G)
 
     def to_graph_msg(self):
         graph_msg = Graph()
         graph_msg.header.seq = self.graph_seq
         graph_msg.header.frame_id = str(self.graph_seq)
-        n_coords = self.G.N
 
         # Write coordinates and adjacency.
-        graph_msg.coords = [None] * n_coords
-        graph_msg.adjacency_matrix = [0] * (n_coords*n_coords)
-        for i in range(0, n_coords):
-            graph_msg.coords[i] = Point()
-            graph_msg.coords[i].x = self.coords[i, 0]
-            graph_msg.coords[i].y = self.coords[i, 1]
-            graph_msg.coords[i].z = self.coords[i, 2]
-            for j in range(0, n_coords):
-                graph_msg.adjacency_matrix[j + i * n_coords] = self.adj[i, j]
+        MsgCodec.write_graph_msg(graph_msg, self.coords, self.adj.toarray())
 
         graph_msg.submap_indices = self.submap_ind
         graph_msg.reduced_indices = self.reduced_ind
@@ -258,7 +227,7 @@ class GlobalGraph(BaseGraph):
 
     def write_graph_to_disk(self, coords_file, adj_file):
         np.save(coords_file, self.coords)
-        np.save(adj_file, self.adj)
+        sparse.save_npz(adj_file, self.adj)
 
     def publish(self):
         if not self.is_built:
@@ -272,58 +241,19 @@ class GlobalGraph(BaseGraph):
             return
 
         # Publish the coordinates of the global graph along with the adjacency matrix
+        pts_h = np.ones((4, n_coords), dtype=np.float32)
+        pts_h[0:3, :] = self.coords[0:n_coords, 0:3].T
+        pts = np.dot(self.config.T_robot_server, pts_h)
         for i in range(0, n_coords):
-            pt_h_i = np.ones((4, 1), dtype=np.float32)
-            pt_h_i[0:3, 0] = self.coords[i, 0:3]
-            pt_i = np.dot(self.config.T_robot_server, pt_h_i)
-            viz.add_graph_coordinate(pt_i)
-
-            for j in range(0, n_coords):
-                pt_h_j = np.ones((4, 1), dtype=np.float32)
-                pt_h_j[0:3, 0] = self.coords[j, 0:3]
-                pt_j = np.dot(self.config.T_robot_server, pt_h_j)
-                if i >= n_coords or j >= self.coords.shape[0]:
-                    continue
-                if i >= self.adj.shape[0] or j >= self.adj.shape[1]:
-                    continue
-                if self.adj[i, j] <= 0.0:
-                    continue
-
-                viz.add_graph_adjacency(pt_i, pt_j)
+            viz.add_graph_coordinate(pts[:, [i]])
+
+        # Only iterate over the stored edges of the sparse adjacency.
+        edges = self.adj.tocoo()
+        for i, j, w in zip(edges.row, edges.col, edges.data):
+            if i >= n_coords or j >= n_coords or w <= 0.0:
+                continue
+            viz.add_graph_adjacency(pts[:, [i]], pts[:, [j]])
         viz.visualize_coords()
         viz.visualize_adjacency()
 
         Logger.LogInfo('GlobalGraph: Visualized global graph.')
-
-    def compute_dirichlet_ratio(self, x1, x2):
-        e1 = self.global_graph.G.dirichlet_energy(x1)
-        e2 = self.global_graph.G.dirichlet_energy(x2)
-        return e1 / e2
-
-    def compute_total_variation_ratio(self, x1, x2):
-        e1 = self.global_graph.G.total_variation_energy(x1)
-        e2 = self.global_graph.G.total_variation_energy(x2)
-        return e1 / e2
-
-    def compute_total_variation(self, x):
-        energy = 0
-        p = 2
-        largest_ev = np.amax(np.abs(self.G.U))
-        adj_norm = 1/largest_ev * self.adj
-        for i in range(0, self.G.N):
-            adj_variation = 0
-            for j in range(0, self.G.N):
-                adj_variation += adj_norm[i, j] * x[j]
-            energy += np.abs(x[i] - adj_variation) ** p
-        return 1/p * energy
-
-    def compute_average_local_variation(self, x1, x2):
-        energy = 0
-        largest_ev = np.amax(np.abs(self.G.U))
-        adj_norm = 1/largest_ev * self.adj
-        for i in range(0, self.G.N):
-            adj_variation = 0
-            for j in range(0, self.G.N):
-                adj_variation += adj_norm[i, j] * np.abs(x1[j] - x2[j])
-            energy += np.abs((x1[i] - x2[i]) - adj_variation)
-        return energy / self.G.N
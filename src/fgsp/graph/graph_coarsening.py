@@ -0,0 +1,147 @@
+#! /usr/bin/env python3
+
+import numpy as np
+from scipy import sparse
+
+from src.fgsp.common.logger import Logger
+from src.fgsp.graph.base_graph import compute_kron_reduction
+from src.fgsp.graph.lazy_graph import LazyGraph
+
+
+class GraphCoarsening(object):
+    def __init__(self, config, spectral_solver):
+        self.method = config.hierarchy_method
+        self.ratio = config.hierarchy_reduction_ratio
+        self.n_eigenvectors = config.hierarchy_n_eigenvectors
+        self.spectral_solver = spectral_solver
+        if self.method not in ['every_other', 'heavy_edge', 'local_variation']:
+            Logger.LogError(
+                f'GraphCoarsening: Unknown method {self.method}. Using every_other.')
+            self.method = 'every_other'
+
+    def coarsen(self, G):
+        # Returns the coarse graph, the representative node of every
+        # cluster and the cluster of every node in G.
+        if self.method == 'every_other':
+            indices = np.arange(0, G.N, 2)
+            clusters = np.searchsorted(
+                indices, np.arange(G.N), side='right') - 1
+            W = compute_kron_reduction(G.L, indices)
+        else:
+            clusters, n_clusters = self.compute_clusters(G)
+            indices = self.compute_representatives(clusters, n_clusters)
+            W = self.coarsen_weights(G.W, clusters, n_clusters)
+
+        coords = G.coords[indices, :] if len(G.coords.shape) else None
+        return LazyGraph(W, coords=coords), indices, clusters
+
+    def compute_clusters(self, G):
+        W = sparse.csr_matrix(G.W)
+        n_nodes = W.shape[0]
+        n_target = max(int(np.ceil(self.ratio * n_nodes)), 2)
+        B = self.compute_spectral_embedding(
+            G) if self.method == 'local_variation' else None
+
+        # Every round contracts a matching, i.e. at most halves the graph.
+        clusters = np.arange(n_nodes)
+        n_clusters = n_nodes
+        while n_clusters > n_target:
+            round_clusters, n_round = self.contract_matching(
+                W, B, n_clusters - n_target)
+            if n_round == n_clusters:
+                break
+            clusters = round_clusters[clusters]
+            W = self.coarsen_weights(W, round_clusters, n_round)
+            if B is not None:
+                B = self.average_over_clusters(B, round_clusters, n_round)
+            n_clusters = n_round
+
+        Logger.LogInfo(
+            f'GraphCoarsening: Coarsened {n_nodes} nodes to {n_clusters} clusters using {self.method}.')
+        return clusters, n_clusters
+
+    def compute_spectral_embedding(self, G):
+        # Rows of U_K * Lambda_K^(-1/2) such that contracting an edge with a
+        # small variation in the embedding preserves the low frequencies.
+        L = sparse.csc_matrix(G.L)
+        k = min(self.n_eigenvectors, G.N - 2)
+        if k < 1:
+            return np.zeros((G.N, 1))
+        e, U = self.spectral_solver.compute_smallest_eigenpairs(L, k)
+        scale = np.zeros_like(e)
+        scale[e > 1e-9] = 1.0 / np.sqrt(e[e > 1e-9])
+        return U * scale
+
+    def contract_matching(self, W, B, max_contractions):
+        edges = sparse.triu(W, k=1).tocoo()
+        rows, cols, weights = edges.row, edges.col, edges.data
+        if B is None:
+            # Heavy-edge matching prefers strong edges between weak nodes.
+            degrees = np.asarray(W.sum(axis=1)).ravel()
+            cost = -weights / np.maximum(degrees[rows], degrees[cols])
+        else:
+            # Local variation of the embedding over the contracted edge.
+            cost = weights * np.sum((B[rows] - B[cols]) ** 2, axis=1)
+
+        # Greedy matching in the order of the cost. Edges that are the cheapest
+        # of both of their nodes are part of the greedy matching and are
+        # contracted in vectorized rounds. The remaining edges are matched in
+        # order once the rounds stall, e.g. for costs that increase along a path.
+        order = np.argsort(cost, kind='stable')
+        rows, cols = rows[order], cols[order]
+        n_nodes = W.shape[0]
+        n_edges = rows.size
+        matched = np.zeros(n_nodes, dtype=bool)
+        selected = []
+        candidates = np.arange(n_edges)
+        while candidates.size > 0:
+            best = np.full(n_nodes, n_edges)
+            np.minimum.at(best, rows[candidates], candidates)
+            np.minimum.at(best, cols[candidates], candidates)
+            dominant = candidates[(best[rows[candidates]] == candidates) &
+                                  (best[cols[candidates]] == candidates)]
+            matched[rows[dominant]] = matched[cols[dominant]] = True
+            selected.append(dominant)
+            n_candidates = candidates.size
+            candidates = candidates[~matched[rows[candidates]]
+                                    & ~matched[cols[candidates]]]
+            if candidates.size > 0.9 * n_candidates:
+                break
+
+        remaining = []
+        for e, i, j in zip(candidates.tolist(), rows[candidates].tolist(), cols[candidates].tolist()):
+            if matched[i] or matched[j]:
+                continue
+            matched[i] = matched[j] = True
+            remaining.append(e)
+        selected.append(np.array(remaining, dtype=np.int64))
+
+        # The greedy loop would stop after the cheapest contractions.
+        selected = np.sort(np.concatenate(selected))[0:max(max_contractions, 0)]
+        parent = np.arange(n_nodes)
+        parent[cols[selected]] = rows[selected]
+        return self.relabel_clusters(parent)
+
+    def relabel_clusters(self, parent):
+        # Clusters are numbered in the order of their first node.
+        roots, clusters = np.unique(parent, return_inverse=True)
+        return clusters, roots.size
+
+    def coarsen_weights(self, W, clusters, n_clusters):
+        P = sparse.csr_matrix((np.ones(clusters.size), (np.arange(clusters.size), clusters)),
+                              shape=(clusters.size, n_clusters))
+        W_coarse = sparse.csr_matrix(P.T.dot(W).dot(P))
+        W_coarse.setdiag(0)
+        W_coarse.eliminate_zeros()
+        return W_coarse
+
+    def average_over_clusters(self, X, clusters, n_clusters):
+        sums = np.zeros((n_clusters, X.shape[1]))
+        np.add.at(sums, clusters, X)
+        return sums / np.bincount(clusters, minlength=n_clusters)[:, None]
+
+    @staticmethod
+    def compute_representatives(clusters, n_clusters):
+        representatives = np.full(n_clusters, clusters.size)
+        np.minimum.at(representatives, clusters, np.arange(clusters.size))
+        return representatives
@@ -0,0 +1,46 @@
+#! /usr/bin/env python3
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg
+
+
+class GraphMetrics(object):
+    # Smoothness measures of graph signals using only sparse products.
+    # Multi-dimensional signals are summed over their dimensions.
+
+    @staticmethod
+    def dirichlet_energy(G, x):
+        return np.sum(x * G.L.dot(x))
+
+    @staticmethod
+    def total_variation(G, x, p=2):
+        # 1/p * ||x - A_norm x||_p^p with A normalized by its spectral radius.
+        W_norm = GraphMetrics.normalize_adjacency(G)
+        return 1.0 / p * np.sum(np.abs(x - W_norm.dot(x)) ** p)
+
+    @staticmethod
+    def average_local_variation(G, x1, x2):
+        W_norm = GraphMetrics.normalize_adjacency(G)
+        diff = x1 - x2
+        return np.sum(np.abs(diff - W_norm.dot(np.abs(diff)))) / G.N
+
+    @staticmethod
+    def compute_ratio(e1, e2):
+        return e1 / e2 if e2 > 0 else np.inf
+
+    @staticmethod
+    def normalize_adjacency(G):
+        lmax = GraphMetrics.estimate_adjacency_lmax(G.W)
+        return G.W / lmax if lmax > 0 else G.W
+
+    @staticmethod
+    def estimate_adjacency_lmax(W):
+        W = sparse.csr_matrix(W)
+        if W.nnz == 0:
+            return 0.0
+        if W.shape[0] <= 2:
+            return np.max(np.abs(np.linalg.eigvalsh(W.toarray())))
+        lmax = linalg.eigsh(W, k=1, which='LM', tol=5e-3,
+                            ncv=min(W.shape[0], 10), return_eigenvectors=False)
+        return np.abs(lmax[0])
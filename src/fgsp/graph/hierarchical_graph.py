@@ -1,21 +1,26 @@
 #! /usr/bin/env python3
 
 import numpy as np
-from pygsp import graphs, reduction
+from scipy import sparse
 
 from src.fgsp.graph.base_graph import BaseGraph
+from src.fgsp.graph.graph_coarsening import GraphCoarsening
+from src.fgsp.graph.lazy_graph import LazyGraph
 from src.fgsp.common.logger import Logger
 from src.fgsp.common.visualizer import Visualizer
 
 
 class HierarchicalGraph(BaseGraph):
-    def __init__(self, config):
-        BaseGraph.__init__(self, config)
+    def __init__(self, config, pool=None, cache=None):
+        BaseGraph.__init__(self, config, pool, cache)
         self.G = [None]
         self.adj = [None]
         self.coords = [None]
         self.indices = [None]
+        self.clusters = [None]
+        self.has_basis = [False]
         self.idx = 0
+        self.coarsening = GraphCoarsening(config, self.spectral_solver)
         self.node_threshold = self.config.graph_hierarchies_node_threshold
         Logger.LogInfo(
             f'HierarchicalGraph: Initialized with a threshold of {self.node_threshold}.')
@@ -24,11 +29,11 @@ class HierarchicalGraph(BaseGraph):
         pass
 
     def build_graph(self):
-        if len(self.adj[self.idx].tolist()) == 0:
+        if self.adj[self.idx].shape[0] == 0:
             Logger.LogInfo(
                 f'HierarchicalGraph: Path adjacency matrix is empty. Aborting graph building.')
             return False
-        self.G[self.idx] = graphs.Graph(self.adj[self.idx])
+        self.G[self.idx] = LazyGraph(self.adj[self.idx])
 
         n_nodes = self.G[self.idx].N
 
@@ -42,27 +47,81 @@ class HierarchicalGraph(BaseGraph):
             return False
 
         self.indices[self.idx] = np.arange(n_nodes)
+        self.clusters[self.idx] = np.arange(n_nodes)
         self.G[self.idx].set_coordinates(self.coords[self.idx][:, [0, 1]])
-        self.G[self.idx].compute_fourier_basis()
+        if self.requires_fourier_basis():
+            self.spectral_solver.compute_fourier_basis(
+                self.G[self.idx], warm_start=True)
+        self.has_basis[self.idx] = True
         self.is_built = True
 
         return True
 
     def build_from_poses(self, poses):
-        self.idx = 0
-        self.coords[self.idx] = poses
-        self.adj[self.idx] = self.create_adjacency_from_poses(
-            self.coords[self.idx])
+        adj = self.update_adjacency_from_poses(poses)
+        if self.is_built and self.is_same_graph(adj, poses):
+            # The existing levels remain valid for an unchanged graph.
+            self.update_coords(poses)
+            return
+
+        self.reset_hierarchy()
+        self.coords[0] = poses
+        self.adj[0] = adj
         self.build_graph()
-        self.build_hierarchies()
+
+    def is_same_graph(self, adj, poses):
+        prev_adj = self.adj[0]
+        if prev_adj is None or prev_adj.shape != adj.shape:
+            return False
+        return self.coords[0].shape == poses.shape and (prev_adj != adj).nnz == 0
+
+    def update_coords(self, poses):
+        # The cached graphs keep their planar coordinates for the filters.
+        self.coords[0] = poses
+        self.G[0].set_coordinates(poses[:, [0, 1]])
+        for i in range(1, self.idx + 1):
+            self.coords[i] = poses[self.indices[i]]
+            self.G[i].set_coordinates(self.coords[i][:, [0, 1]])
+
+    def reset_hierarchy(self):
+        self.G = [None]
+        self.adj = [None]
+        self.coords = [None]
+        self.indices = [None]
+        self.clusters = [None]
+        self.has_basis = [False]
+        self.idx = 0
+        self.is_built = False
 
     def build_hierarchies(self):
-        while (self.idx+1) < self.config.max_graph_levels and self.build_hierarchy():
+        while self.build_hierarchy():
             pass
 
+    def build_level(self, idx):
+        # Levels and their Fourier basis are built on their first request.
+        # Negative indices refer to the top level of the hierarchy.
+        if idx < 0:
+            self.build_hierarchies()
+            level = self.idx
+        else:
+            while self.idx < idx and self.build_hierarchy():
+                pass
+            level = min(idx, self.idx)
+        self.compute_level_basis(level)
+        return level
+
+    def compute_level_basis(self, level):
+        if not self.is_built or self.has_basis[level]:
+            return
+        if self.requires_fourier_basis():
+            self.spectral_solver.compute_fourier_basis(self.G[level])
+        self.has_basis[level] = True
+
     def build_hierarchy(self):
         if not self.is_built:
             return False
+        if (self.idx+1) >= self.config.max_graph_levels:
+            return False
         current_n = self.G[self.idx].N
         if current_n <= self.node_threshold:
             return False
@@ -70,36 +129,37 @@ class HierarchicalGraph(BaseGraph):
         self.adj.append(None)
         self.G.append(None)
         self.indices.append(None)
+        self.clusters.append(None)
+        self.has_basis.append(False)
 
-        indices = self.reduce_every_other(self.coords[self.idx])
-        G_next = reduction.kron_reduction(self.G[self.idx], indices)
+        G_next, indices, clusters = self.coarsening.coarsen(
+            self.G[self.idx])
 
         self.idx = self.idx + 1
         self.indices[self.idx] = self.indices[self.idx - 1][indices]
+        self.clusters[self.idx] = clusters[self.clusters[self.idx - 1]]
         self.G[self.idx] = G_next
-        self.adj[self.idx] = G_next.W.toarray()
+        self.adj[self.idx] = sparse.csr_matrix(G_next.W)
         self.coords[self.idx] = self.coords[self.idx - 1][indices]
 
         return True
 
     def get_graph(self, idx=-1):
-        if idx < 0:
-            idx = self.idx
-        return self.G[idx]
+        return self.G[self.build_level(idx)]
 
     def get_coords(self, idx=-1):
-        if idx < 0:
-            idx = self.idx
-        return self.coords[idx]
+        return self.coords[self.build_level(idx)]
 
     def get_indices(self, idx=-1):
-        if idx < 0:
-            idx = self.idx
-        return self.indices[idx]
+        return self.indices[self.build_level(idx)]
+
+    def get_clusters(self, idx=-1):
+        # Maps every level-0 node to its node in the requested level.
+        return self.clusters[self.build_level(idx)]
 
     def write_graph_to_disk(self, coords_file, adj_file):
         np.save(coords_file, self.coords[0])
-        np.save(adj_file, self.adj[0])
+        sparse.save_npz(adj_file, self.adj[0])
 
     def publish(self):
         if not self.is_built:
@@ -121,23 +181,20 @@ class HierarchicalGraph(BaseGraph):
 
         color = self.get_level_color(level)
         z = np.array([0, 0, 5 * level])
+        pts_h = np.ones((4, n_nodes), dtype=np.float32)
+        pts_h[0:3, :] = coords[0:n_nodes, 0:3].T
+        pts = np.dot(self.config.T_robot_server, pts_h)
+        pts_h[0:3, :] += z[:, None]
+        pts_z = np.dot(self.config.T_robot_server, pts_h)
         for i in range(0, n_nodes):
-            pt_h_i = np.ones((4, 1), dtype=np.float32)
-            pt_h_i[0:3, 0] = coords[i, 0:3] + z
-            pt_i = np.dot(self.config.T_robot_server, pt_h_i)
-            viz.add_graph_coordinate(pt_i, color)
-
-            for j in range(0, n_nodes):
-                pt_h_j = np.ones((4, 1), dtype=np.float32)
-                pt_h_j[0:3, 0] = coords[j, 0:3]
-                pt_j = np.dot(self.config.T_robot_server, pt_h_j)
-                if i >= n_nodes or j >= coords.shape[0]:
-                    continue
-                if i >= adj.shape[0] or j >= adj.shape[1]:
-                    continue
-                if adj[i, j] <= 0.0:
-                    continue
-                viz.add_graph_adjacency(pt_i, pt_j)
+            viz.add_graph_coordinate(pts_z[:, [i]], color)
+
+        # Edges start at the lifted level and end at the original position.
+        edges = adj.tocoo()
+        for i, j, w in zip(edges.row, edges.col, edges.data):
+            if i >= n_nodes or j >= n_nodes or w <= 0.0:
+                continue
+            viz.add_graph_adjacency(pts_z[:, [i]], pts[:, [j]])
         Logger.LogDebug(f'HierarchicalGraph: Visualized graph level {level}.')
 
     def get_level_color(self, idx):
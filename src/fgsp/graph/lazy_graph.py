@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+
+import numpy as np
+from pygsp import graphs
+from scipy import sparse, linalg
+from scipy.sparse import linalg as sparse_linalg
+
+
+class LazyGraph(object):
+    # Undirected graph with a combinatorial Laplacian that only holds the
+    # sparse weights. All operators are computed on their first access and
+    # the graph is converted to pygsp only for pygsp-specific routines.
+    def __init__(self, W, coords=None):
+        self.W = sparse.csr_matrix(W, dtype=np.float64)
+        self.N = self.W.shape[0]
+        self.n_vertices = self.N
+        self.lap_type = 'combinatorial'
+        self.coords = np.ndarray(()) if coords is None else np.asarray(coords)
+        self._d = None
+        self._dw = None
+        self._L = None
+        self._lmax = None
+        self._e = None
+        self._U = None
+        self._pygsp = None
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not defined here.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.to_pygsp(), name)
+
+    @property
+    def d(self):
+        if self._d is None:
+            self._d = self.W.getnnz(axis=1)
+        return self._d
+
+    @property
+    def dw(self):
+        if self._dw is None:
+            self._dw = np.ravel(self.W.sum(axis=0))
+        return self._dw
+
+    @property
+    def L(self):
+        if self._L is None:
+            self._L = sparse.csr_matrix(sparse.diags(self.dw) - self.W)
+        return self._L
+
+    @property
+    def lmax(self):
+        if self._lmax is None:
+            self.estimate_lmax()
+        return self._lmax
+
+    @property
+    def e(self):
+        if self._e is None:
+            self.compute_fourier_basis()
+        return self._e
+
+    @property
+    def U(self):
+        if self._U is None:
+            self.compute_fourier_basis()
+        return self._U
+
+    def is_directed(self):
+        return False
+
+    def set_coordinates(self, coords):
+        self.coords = np.asarray(coords)
+        self._pygsp = None
+
+    def estimate_lmax(self):
+        # Same estimate as pygsp, i.e. Lanczos increased by one percent.
+        if self.W.nnz == 0 or self.N <= 2:
+            self._lmax = self.clamp_lmax(
+                np.max(linalg.eigvalsh(self.L.toarray()), initial=0.0))
+            return
+        lmax = sparse_linalg.eigsh(
+            self.L, k=1, tol=5e-3, ncv=min(self.N, 10), return_eigenvectors=False)
+        self._lmax = self.clamp_lmax(lmax[0] * 1.01)
+
+    def clamp_lmax(self, lmax):
+        # Edgeless graphs have a zero spectrum but the filters are scaled by
+        # lmax, hence, it is kept strictly positive.
+        return max(lmax, 1e-6)
+
+    def compute_fourier_basis(self):
+        self._e, self._U = linalg.eigh(self.L.toarray())
+        self._e[0] = 0
+        self._lmax = self.clamp_lmax(self._e[-1])
+        self._pygsp = None
+
+    def to_pygsp(self):
+        if self._pygsp is None:
+            G = graphs.Graph(self.W)
+            if len(self.coords.shape) > 0:
+                G.set_coordinates(self.coords)
+            if self._U is not None:
+                G._e = self._e
+                G._U = self._U
+            if self._lmax is not None:
+                G._lmax = self._lmax
+            self._pygsp = G
+        return self._pygsp
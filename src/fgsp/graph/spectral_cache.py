@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+
+import os
+import glob
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from scipy import sparse
+
+from src.fgsp.common.logger import Logger
+
+
+class SpectralCache(object):
+    def __init__(self, max_bytes, cache_dir=None, max_disk_bytes=0):
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.cache_dir = cache_dir if max_disk_bytes > 0 else None
+        if self.cache_dir is not None and not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        Logger.LogInfo(
+            f'SpectralCache: Initialized with {max_bytes} bytes in memory and {max_disk_bytes} bytes on disk.')
+
+    @staticmethod
+    def compute_key(adj, *args):
+        adj = sparse.csr_matrix(adj)
+        if not adj.has_sorted_indices:
+            adj = adj.sorted_indices()
+
+        h = hashlib.sha1()
+        h.update(np.array(adj.shape, dtype=np.int64).tobytes())
+        h.update(adj.indptr.astype(np.int64).tobytes())
+        h.update(adj.indices.astype(np.int64).tobytes())
+        h.update(adj.data.astype(np.float64).tobytes())
+        for arg in args:
+            if isinstance(arg, np.ndarray):
+                h.update(np.ascontiguousarray(arg).tobytes())
+            else:
+                h.update(repr(arg).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        arrays = self.read_from_disk(key)
+        if arrays is not None:
+            self.add_to_memory(key, arrays)
+        return arrays
+
+    def put(self, key, **arrays):
+        self.add_to_memory(key, arrays)
+        self.write_to_disk(key, arrays)
+
+    def add_to_memory(self, key, arrays):
+        n_bytes = sum(a.nbytes for a in arrays.values())
+        if n_bytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.remove_from_memory(key)
+        self.entries[key] = arrays
+        self.n_bytes += n_bytes
+
+        # Evict the least recently used entries.
+        while self.n_bytes > self.max_bytes:
+            self.remove_from_memory(next(iter(self.entries)))
+
+    def remove_from_memory(self, key):
+        arrays = self.entries.pop(key)
+        self.n_bytes -= sum(a.nbytes for a in arrays.values())
+
+    def get_disk_filename(self, key):
+        return f'{self.cache_dir}/{key}.npz'
+
+    def read_from_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        filename = self.get_disk_filename(key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with np.load(filename) as data:
+                arrays = {name: data[name] for name in data.files}
+        except Exception as e:
+            Logger.LogWarn(
+                f'SpectralCache: Unable to read {filename}: {e}')
+            return None
+
+        # Touch the file so that the disk tier is evicted in LRU order as well.
+        os.utime(filename)
+        return arrays
+
+    def write_to_disk(self, key, arrays):
+        if self.cache_dir is None:
+            return
+        n_bytes = sum(a.nbytes for a in arrays.values())
+        if n_bytes > self.max_disk_bytes:
+            return
+        filename = self.get_disk_filename(key)
+        np.savez(filename, **arrays)
+        self.evict_from_disk()
+
+    def evict_from_disk(self):
+        files = sorted(glob.glob(f'{self.cache_dir}/*.npz'),
+                       key=os.path.getmtime)
+        sizes = [os.path.getsize(f) for f in files]
+        n_bytes = sum(sizes)
+        for filename, size in zip(files, sizes):
+            if n_bytes <= self.max_disk_bytes:
+                break
+            os.remove(filename)
+            n_bytes -= size
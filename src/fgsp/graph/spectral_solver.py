@@ -0,0 +1,183 @@
+#! /usr/bin/env python3
+
+import warnings
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg
+
+from src.fgsp.common.logger import Logger
+from src.fgsp.graph.spectral_cache import SpectralCache
+
+
+class SpectralSolver(object):
+    def __init__(self, config, cache=None):
+        self.cache = cache
+        self.method = config.fourier_basis_method
+        self.n_eigenvectors = config.fourier_basis_n_eigenvectors
+        self.band_center = config.fourier_basis_band_center
+        self.use_warm_start = config.fourier_basis_warm_start
+        self.warm_start_tol = config.fourier_basis_warm_start_tol
+        self.warm_start_n_extra = config.fourier_basis_warm_start_n_extra
+        self.prev_U = None
+
+    def compute_fourier_basis(self, G, warm_start=False):
+        # Polynomial filters only need an estimate of the largest eigenvalue.
+        if self.method == 'none':
+            G.estimate_lmax()
+            return
+
+        key = None
+        if self.cache is not None:
+            key = SpectralCache.compute_key(
+                G.W, self.method, self.n_eigenvectors, self.band_center)
+            basis = self.cache.get(key)
+            if basis is not None:
+                Logger.LogDebug('SpectralSolver: Using cached Fourier basis.')
+                self.set_fourier_basis(G, basis['e'], basis['U'])
+                if warm_start:
+                    self.prev_U = basis['U']
+                return
+
+        e, U = self.solve_warm_started(G) if warm_start else (None, None)
+        if e is None:
+            e, U = self.solve(G)
+        if warm_start:
+            self.prev_U = U
+        self.set_fourier_basis(G, e, U)
+        if key is not None:
+            self.cache.put(key, e=e, U=U)
+
+    def solve(self, G):
+        n_nodes = G.N
+        n_eigenvectors = min(self.n_eigenvectors, n_nodes)
+
+        # The iterative solver requires k < N.
+        if self.method == 'full' or n_eigenvectors >= n_nodes - 1:
+            G.compute_fourier_basis()
+            return G.e, G.U
+
+        L = sparse.csc_matrix(G.L)
+        if self.method == 'smallest':
+            e, U = self.compute_smallest_eigenpairs(L, n_eigenvectors)
+        elif self.method == 'band':
+            e, U = self.compute_band_eigenpairs(L, n_eigenvectors)
+        else:
+            Logger.LogError(
+                f'SpectralSolver: Unknown method {self.method}. Computing the full basis.')
+            G.compute_fourier_basis()
+            return G.e, G.U
+
+        Logger.LogDebug(
+            f'SpectralSolver: Computed {n_eigenvectors}/{n_nodes} eigenpairs in [{e[0]}, {e[-1]}].')
+        return e, U
+
+    def solve_warm_started(self, G):
+        # Only the smallest eigenpairs are refined from the previous basis.
+        if not self.use_warm_start or self.prev_U is None or self.method != 'smallest':
+            return None, None
+        n_nodes = G.N
+        n_prev, n_eigenvectors = self.prev_U.shape
+        n_extra = self.warm_start_n_extra
+        if n_nodes < n_prev or n_eigenvectors != min(self.n_eigenvectors, n_nodes) \
+                or 5 * (n_eigenvectors + n_extra) >= n_nodes:
+            return None, None
+
+        # Rayleigh-Ritz on the zero-padded previous basis and a few random
+        # vectors that cover the new nodes.
+        X = np.zeros((n_nodes, n_eigenvectors + n_extra))
+        X[0:n_prev, 0:n_eigenvectors] = self.prev_U
+        X[:, n_eigenvectors:] = np.random.default_rng(0).standard_normal(
+            (n_nodes, n_extra))
+        L = sparse.csc_matrix(G.L)
+        e, U = self.compute_ritz_pairs(L, X)
+
+        # Converged Ritz pairs are locked and the remaining ones are solved
+        # for in their orthogonal complement. The extra eigenpairs of the
+        # complement replace locked ones that are not among the smallest.
+        residuals = self.compute_residuals(L, e, U)
+        locked = np.flatnonzero(
+            residuals[0:n_eigenvectors] < 0.1 * self.warm_start_tol)
+        n_missing = n_eigenvectors - locked.size
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                e_missing, U_missing = self.compute_deflated_eigenpairs(
+                    L, U[:, locked], n_missing + n_extra)
+        except Exception as ex:
+            Logger.LogWarn(f'SpectralSolver: Warm start failed: {ex}')
+            return None, None
+        e = np.concatenate([e[locked], e_missing])
+        U = np.column_stack([U[:, locked], U_missing])
+        e, U = self.sort_eigenpairs(e, U)
+        e, U = e[0:n_eigenvectors], U[:, 0:n_eigenvectors]
+
+        max_residual = np.max(self.compute_residuals(L, e, U))
+        if max_residual > self.warm_start_tol:
+            Logger.LogWarn(
+                f'SpectralSolver: Warm start residual {max_residual} too large. Solving from scratch.')
+            return None, None
+        if np.abs(e[0]) > self.warm_start_tol:
+            Logger.LogWarn(
+                f'SpectralSolver: Warm start missed the zero eigenvalue with {e[0]}. Solving from scratch.')
+            return None, None
+
+        Logger.LogDebug(
+            f'SpectralSolver: Warm started {n_eigenvectors} eigenpairs with {n_nodes - n_prev} new nodes and {n_missing} unconverged ones.')
+        if np.abs(e[0]) < 1e-5:
+            e[0] = 0
+        return e, U
+
+    def compute_ritz_pairs(self, L, X):
+        Q, _ = np.linalg.qr(X)
+        e, V = np.linalg.eigh(Q.T.dot(L.dot(Q)))
+        return e, Q.dot(V)
+
+    def compute_residuals(self, L, e, U):
+        # Relative to the largest eigenvalue but at least absolute.
+        residuals = np.linalg.norm(L.dot(U) - U * e, axis=0)
+        return residuals / max(e[-1], 1.0)
+
+    def compute_deflated_eigenpairs(self, L, Y, k):
+        # Shift-invert as for the smallest eigenpairs but restricted to the
+        # orthogonal complement of the locked eigenvectors Y.
+        n_nodes = L.shape[0]
+        lu = linalg.splu(sparse.csc_matrix(
+            L + 1e-3 * sparse.identity(n_nodes)))
+
+        def solve_deflated(x):
+            x = lu.solve(x - Y.dot(Y.T.dot(x)))
+            return x - Y.dot(Y.T.dot(x))
+
+        OPinv = linalg.LinearOperator(
+            (n_nodes, n_nodes), matvec=solve_deflated, dtype=np.float64)
+        e, U = linalg.eigsh(L, k=k, sigma=-1e-3, which='LM', OPinv=OPinv,
+                            tol=0.01 * self.warm_start_tol)
+        return e, U
+
+    def compute_smallest_eigenpairs(self, L, k):
+        # Shift-invert slightly below zero as the Laplacian is singular.
+        e, U = linalg.eigsh(L, k=k, sigma=-1e-3, which='LM')
+        e, U = self.sort_eigenpairs(e, U)
+
+        # Correct numerical errors of the constant eigenvector like pygsp.
+        if np.abs(e[0]) < 1e-5:
+            e[0] = 0
+        return e, U
+
+    def compute_band_eigenpairs(self, L, k):
+        e, U = linalg.eigsh(L, k=k, sigma=self.band_center, which='LM')
+        return self.sort_eigenpairs(e, U)
+
+    def sort_eigenpairs(self, e, U):
+        order = np.argsort(e)
+        return e[order], U[:, order]
+
+    def set_fourier_basis(self, G, e, U):
+        # pygsp has no setter for a truncated basis. The largest eigenvalue
+        # is estimated separately as it is needed for the filter design.
+        G._e = e
+        G._U = U
+        if e.shape[0] == G.N:
+            G._lmax = G.clamp_lmax(e[-1])
+        else:
+            G.estimate_lmax()
@@ -1,15 +1,20 @@
 #! /usr/bin/env python3
 
 from platform import node
+import os
+import tempfile
+import weakref
 import numpy as np
 from pygsp import graphs, filters, reduction
+from scipy import sparse
 from enum import Enum
 
-import pandas
 import scipy.spatial
+from concurrent.futures import ThreadPoolExecutor
 
 
 from src.fgsp.common.logger import Logger
+from src.fgsp.graph.spectral_cache import SpectralCache
 
 
 class SubmapState(Enum):
@@ -21,13 +26,24 @@ class SubmapState(Enum):
 
 class WaveletEvaluator(object):
 
-    def __init__(self, n_scales=6):
+    def __init__(self, n_scales=6, engine='spectral', chebyshev_order=30, cache=None, storage='dense', storage_dir=None, feature_columns=None):
         assert n_scales >= 3, 'n_scales must be at least 3.'
         self.n_scales = n_scales
+        self.cache = cache
+        self.engine = engine
+        self.chebyshev_order = chebyshev_order
+        self.chebyshev_coeffs = None
+        self.filter_response = None
+        self.storage = storage
+        self.storage_dir = storage_dir if storage_dir else None
+        self.storage_file = None
+        self.storage_finalizer = None
         self.psi = None
+        self.node_range = None
         self.G = None
         self.feature_names = ['Euclidean_L', 'Euclidean_B', 'Euclidean_H', 'Correlation_L', 'Correlation_B',
                               'Correlation_H', 'Manhattan_L', 'Manhattan_B', 'Manhattan_H', 'Chebyshev_L', 'Chebyshev_B', 'Chebyshev_H']
+        self.feature_columns = self.get_feature_columns(feature_columns)
         self.ranges = self.compute_constraint_ranges()
         Logger.LogDebug(
             f'WaveletEvaluator: Created with ranges: {self.ranges}.')
@@ -46,7 +62,56 @@ class WaveletEvaluator(object):
     def get_wavelets(self):
         return self.psi
 
+    def release_wavelets(self):
+        self.psi = None
+        if self.storage_finalizer is not None:
+            self.storage_finalizer()
+            self.storage_finalizer = None
+            self.storage_file = None
+
+    @staticmethod
+    def remove_storage_file(storage_file):
+        if os.path.exists(storage_file):
+            os.remove(storage_file)
+
+    def create_compact_storage(self, n):
+        # Scale-major float32 operators backed by a file such that only
+        # the rows required for the coefficients are paged in.
+        fd, self.storage_file = tempfile.mkstemp(
+            prefix='fgsp_psi_', suffix='.dat', dir=self.storage_dir)
+        os.close(fd)
+
+        # The file is also removed when the evaluator is dropped or at exit.
+        self.storage_finalizer = weakref.finalize(
+            self, WaveletEvaluator.remove_storage_file, self.storage_file)
+        return np.memmap(self.storage_file, dtype=np.float32,
+                         mode='w+', shape=(self.n_scales, n, n))
+
+    def get_graph_size(self):
+        return self.G.N if self.G is not None else 0
+
     def compute_wavelets(self, G, node_range=None):
+        self.release_wavelets()
+        self.node_range = node_range
+        if self.engine == 'chebyshev':
+            return self.compute_chebyshev_filters(G)
+        elif self.engine == 'spectral_direct':
+            return self.compute_filter_response(G)
+        elif self.engine != 'spectral':
+            Logger.LogError(
+                f'WaveletEvaluator: Unknown engine {self.engine}. Using spectral wavelets.')
+
+        key = None
+        if self.cache is not None and self.storage == 'dense':
+            key = SpectralCache.compute_key(
+                G.W, G.e, self.n_scales, node_range)
+            cached = self.cache.get(key)
+            if cached is not None:
+                Logger.LogInfo('WaveletEvaluator: Using cached wavelets.')
+                self.G = G
+                self.psi = cached['psi']
+                return self.psi
+
         Logger.LogInfo(
             f'WaveletEvaluator: Computing wavelets for {self.n_scales} scales.')
         g = filters.Meyer(G, self.n_scales)
@@ -57,6 +122,11 @@ class WaveletEvaluator(object):
             Logger.LogWarn(
                 f'WaveletEvaluator: Computing wavelets for nodes {node_range}.')
         n = G.N
+        if self.storage == 'compact':
+            return self.compute_compact_wavelets(G, g, node_range)
+        elif self.storage != 'dense':
+            Logger.LogError(
+                f'WaveletEvaluator: Unknown storage {self.storage}. Using dense storage.')
 
         # Evalute filter bank on the frequencies (eigenvalues).
         f = g.evaluate(G.e)
@@ -70,7 +140,8 @@ class WaveletEvaluator(object):
             x[i] = 1
 
             # Transform the signal to spectral domain.
-            s = G.gft(x)
+            # The basis might be truncated, hence we don't use G.gft.
+            s = np.matmul(G.U.T, x)
 
             # Multiply the transformed signal with filter.
             if s.ndim == 1:
@@ -79,23 +150,149 @@ class WaveletEvaluator(object):
             s = np.matmul(s, f)  # [nodes, features, scales]
 
             # Transform back the features to the vertex domain.
-            self.psi[i, :, :] = G.igft(s).squeeze()
+            self.psi[i, :, :] = np.tensordot(G.U, s, ([1], [0])).squeeze()
+
+        if key is not None:
+            self.cache.put(key, psi=self.psi)
+        return self.psi
+
+    def compute_compact_wavelets(self, G, g, node_range, chunk_size=256):
+        f = g.evaluate(G.e)
+        self.psi = self.create_compact_storage(G.N)
+        self.G = G
+
+        # psi_s[i, j] = sum_k U[i, k] g_s(e_k) U[j, k], computed per block.
+        for start in range(0, len(node_range), chunk_size):
+            rows = node_range[start:start+chunk_size]
+            U_rows = G.U[rows, :]
+            for j in range(self.n_scales):
+                self.psi[j, rows, :] = np.matmul(U_rows * f[j], G.U.T)
+        self.psi.flush()
+        return self.psi
+
+    def compute_filter_response(self, G):
+        Logger.LogInfo(
+            f'WaveletEvaluator: Evaluating filters for {self.n_scales} scales.')
+        g = filters.Meyer(G, self.n_scales)
+        self.G = G
+        self.psi = None
+        self.filter_response = g.evaluate(G.e)
+        return self.psi
 
+    def compute_chebyshev_filters(self, G):
+        Logger.LogInfo(
+            f'WaveletEvaluator: Approximating wavelets for {self.n_scales} scales with order {self.chebyshev_order}.')
+        g = filters.Meyer(G, self.n_scales)
+        self.G = G
+        self.psi = None
+
+        # Chebyshev coefficients of each filter on [0, lmax].
+        n_points = self.chebyshev_order + 1
+        half_lmax = G.lmax / 2.0
+        theta = np.pi * (np.arange(n_points) + 0.5) / n_points
+        f = g.evaluate(half_lmax * np.cos(theta) + half_lmax)
+        T = np.cos(np.outer(theta, np.arange(n_points)))
+        self.chebyshev_coeffs = 2.0 / n_points * np.matmul(f, T)
         return self.psi
 
     def compute_wavelet_coeffs(self, x_signal):
-        return self.compute_wavelet_coeffs_using_wavelet(self.psi, x_signal)
+        return self.compute_wavelet_coeffs_batch([x_signal])[0]
+
+    def compute_wavelet_coeffs_batch(self, signals, node_ranges=None, n_workers=1):
+        # Stacks all signals as columns such that every engine evaluates
+        # the whole batch at once. Returns the coefficients per signal.
+        # If node ranges are given, only their rows are computed.
+        n_values = signals[0].shape[0]
+        columns = [x.reshape(n_values, -1) for x in signals]
+        X = np.column_stack(columns)
+
+        if self.engine != 'chebyshev' and node_ranges is not None:
+            W = self.compute_coeffs_for_node_ranges(X, node_ranges, n_workers)
+        elif self.engine == 'chebyshev':
+            W = self.compute_coeffs_using_chebyshev(X)
+        elif self.engine == 'spectral_direct':
+            W = self.compute_coeffs_using_basis(X)
+        elif self.storage == 'compact':
+            W = self.compute_coeffs_using_compact_wavelet(X)
+        else:
+            W = self.compute_coeffs_using_wavelet(self.psi, X)
+
+        coeffs = []
+        offset = 0
+        for x in columns:
+            n_dim = x.shape[1]
+            W_x = W[:, :, offset:offset+n_dim]
+            coeffs.append(W_x[:, :, 0] if n_dim == 1 else np.mean(W_x, axis=2))
+            offset += n_dim
+        return coeffs
+
+    def compute_coeffs_using_chebyshev(self, X):
+        # The filters are symmetric, hence the coefficient of node i at
+        # scale j is (g_j(L) x)[i] which only needs products with L.
+        L = sparse.csr_matrix(self.G.L)
+        half_lmax = self.G.lmax / 2.0
+        c = self.chebyshev_coeffs
+
+        T_prev = X
+        T_cur = (L.dot(X) - half_lmax * X) / half_lmax
+        W = 0.5 * c[None, :, 0, None] * T_prev[:, None, :] + \
+            c[None, :, 1, None] * T_cur[:, None, :]
+        for k in range(2, self.chebyshev_order + 1):
+            T_next = 2.0 * (L.dot(T_cur) - half_lmax *
+                            T_cur) / half_lmax - T_prev
+            W += c[None, :, k, None] * T_next[:, None, :]
+            T_prev = T_cur
+            T_cur = T_next
+        return W
+
+    def compute_coeffs_using_basis(self, X):
+        # U * diag(g_s(e)) * U^T * X for all scales without forming psi.
+        U = self.G.U
+        X_hat = np.matmul(U.T, X)
+        Y = self.filter_response.T[:, :, None] * X_hat[:, None, :]
+        return np.tensordot(U, Y, axes=([1], [0]))
+
+    def compute_coeffs_for_node_ranges(self, X, node_ranges, n_workers):
+        W = np.zeros((X.shape[0], self.n_scales, X.shape[1]))
+        X_hat = np.matmul(self.G.U.T, X) if self.psi is None else None
+
+        def compute_rows(rows):
+            W[rows] = self.compute_coeff_rows(rows, X, X_hat)
+
+        # The ranges are independent and numpy releases the GIL.
+        with ThreadPoolExecutor(max_workers=max(1, n_workers)) as executor:
+            list(executor.map(compute_rows, node_ranges))
+        return W
+
+    def compute_coeff_rows(self, rows, X, X_hat):
+        if self.psi is None:
+            U_rows = self.G.U[rows, :]
+            return np.matmul(U_rows[:, None, :] * self.filter_response[None, :, :], X_hat)
+        elif self.storage == 'compact':
+            return np.stack([np.matmul(self.psi[j, rows, :], X) for j in range(self.n_scales)], axis=1)
+        else:
+            return self.compute_coeffs_using_wavelet(self.psi[rows], X)
+
+    def compute_coeffs_using_compact_wavelet(self, X, chunk_size=256):
+        # Rows outside of the node range are zero and are never read.
+        n_nodes = self.psi.shape[1]
+        rows = np.arange(
+            n_nodes) if self.node_range is None else np.asarray(self.node_range)
+        W = np.zeros((n_nodes, self.n_scales, X.shape[1]))
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start+chunk_size]
+            for j in range(self.n_scales):
+                W[chunk, j, :] = np.matmul(self.psi[j, chunk, :], X)
+        return W
+
+    def compute_coeffs_using_wavelet(self, wavelet, X):
+        return np.einsum('nks,kc->nsc', wavelet, X)
 
     def compute_wavelet_coeffs_using_wavelet(self, wavelet, x_signal):
         n_values = x_signal.shape[0]
-        n_dim = x_signal.shape[1] if len(x_signal.shape) >= 2 else 1
-        W = np.zeros((n_values, self.n_scales, n_dim)).squeeze()
-
-        for i in range(0, n_values):
-            for j in range(0, self.n_scales):
-                W[i, j] = np.matmul(wavelet[i, :, j].transpose(), x_signal)
-
-        return W if n_dim == 1 else np.mean(W, axis=2)
+        x = x_signal.reshape(n_values, -1)
+        W = self.compute_coeffs_using_wavelet(wavelet, x)
+        return W[:, :, 0] if x.shape[1] == 1 else np.mean(W, axis=2)
 
     def compute_distances_1D(self, coeffs_1, coeffs_2):
         distances = np.zeros((1, self.n_scales))
@@ -106,34 +303,40 @@ class WaveletEvaluator(object):
         return distances
 
     def compute_features(self, submap_coeffs_1, submap_coeffs_2):
+        features = self.compute_all_features(submap_coeffs_1, submap_coeffs_2)
+        return features[:, self.feature_columns]
+
+    def compute_all_features(self, submap_coeffs_1, submap_coeffs_2):
+        # Computes all named features of the low, band and high scale ranges
+        # for every node. The columns are ordered like self.feature_names.
         n_nodes = submap_coeffs_1.shape[0]
-        all_data = pandas.DataFrame()
-        for i in range(n_nodes):
-            D = self.compute_distances_1D(
-                submap_coeffs_1[i, :], submap_coeffs_2[i, :])
-            data = pandas.DataFrame({
-                # self.feature_names[0]: [np.sum(D[0, 0:2])],
-                # self.feature_names[1]: [np.sum(D[0, 2:4])],
-                # self.feature_names[2]: [np.sum(D[0, 4:6])],
-
-                # self.feature_names[0]: [np.sum(D[0, 0:3])],
-                # self.feature_names[1]: [np.sum(D[0, 3:6])],
-                # self.feature_names[2]: [np.sum(D[0, 6:9])],
-
-                # self.feature_names[0]: [np.sum(D[0, 0:4])],
-                # self.feature_names[1]: [np.sum(D[0, 4:8])],
-                # self.feature_names[2]: [np.sum(D[0, 8:12])],
-
-                self.feature_names[0]: [np.sum(D[0, self.ranges[0]])],
-                self.feature_names[1]: [np.sum(D[0, self.ranges[1]])],
-                self.feature_names[2]: [np.sum(D[0, self.ranges[2]])],
-
-                # self.feature_names[0]: [np.sum(D[0, 0])],
-                # self.feature_names[1]: [np.sum(D[0, 1])],
-                # self.feature_names[2]: [np.sum(D[0, 2])],
-            })
-            all_data = pandas.concat([all_data, data])
-        return np.nan_to_num(all_data)
+        features = np.zeros((n_nodes, len(self.feature_names)))
+        for i, scale_range in enumerate(self.ranges):
+            u = submap_coeffs_1[:, scale_range]
+            v = submap_coeffs_2[:, scale_range]
+            diff = np.abs(u - v)
+            features[:, i] = np.sqrt(np.sum(diff ** 2, axis=1))
+            features[:, 3 + i] = self.compute_correlation_distances(u, v)
+            features[:, 6 + i] = np.sum(diff, axis=1)
+            features[:, 9 + i] = np.max(diff, axis=1)
+        return np.nan_to_num(features)
+
+    def compute_correlation_distances(self, u, v):
+        u = u - np.mean(u, axis=1, keepdims=True)
+        v = v - np.mean(v, axis=1, keepdims=True)
+        norm = np.sqrt(np.sum(u ** 2, axis=1) * np.sum(v ** 2, axis=1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 1.0 - np.sum(u * v, axis=1) / norm
+
+    def get_feature_columns(self, feature_columns):
+        if feature_columns is None:
+            feature_columns = self.feature_names[6:9]
+        unknown = [c for c in feature_columns if c not in self.feature_names]
+        if len(unknown) > 0:
+            Logger.LogError(
+                f'WaveletEvaluator: Unknown features {unknown}. Using the default features.')
+            feature_columns = self.feature_names[6:9]
+        return [self.feature_names.index(c) for c in feature_columns]
 
 
 if __name__ == '__main__':
@@ -11,6 +11,8 @@ from multiprocessing import Lock
 from src.fgsp.graph.wavelet_evaluator import WaveletEvaluator
 from src.fgsp.graph.global_graph import GlobalGraph
 from src.fgsp.graph.hierarchical_graph import HierarchicalGraph
+from src.fgsp.graph.construction_pool import ConstructionPool
+from src.fgsp.graph.spectral_cache import SpectralCache
 from src.fgsp.controller.signal_handler import SignalHandler
 from src.fgsp.controller.command_post import CommandPost
 from src.fgsp.common.signal_synchronizer import SignalSynchronizer
@@ -43,6 +45,18 @@ class GraphClient(Node):
         Plotter.PrintSeparator()
         Logger.Verbosity = self.config.verbosity
 
+        # Spawn the workers before any subscriptions are set up.
+        self.construction_pool = ConstructionPool(
+            self.config.construction_workers)
+
+        # The cache lives under the configured dataroot to survive restarts.
+        self.spectral_cache = None
+        if self.config.use_spectral_cache:
+            self.spectral_cache = SpectralCache(
+                self.config.spectral_cache_max_mb * 1024 * 1024,
+                self.config.dataroot + '/cache',
+                self.config.spectral_cache_disk_max_mb * 1024 * 1024)
+
         self.mutex = Lock()
         self.constraint_mutex = Lock()
         self.mutex.acquire()
@@ -61,15 +75,19 @@ class GraphClient(Node):
 
         # Handlers and evaluators.
         if self.config.use_graph_hierarchies:
-            self.global_graph = HierarchicalGraph(self.config)
+            self.global_graph = HierarchicalGraph(
+                self.config, self.construction_pool, self.spectral_cache)
         else:
-            self.global_graph = GlobalGraph(self.config, reduced=False)
+            self.global_graph = GlobalGraph(
+                self.config, reduced=False, pool=self.construction_pool, cache=self.spectral_cache)
 
         self.latest_traj_msg = None
         self.signal = SignalHandler(self.config)
         self.optimized_signal = SignalHandler(self.config)
         self.synchronizer = SignalSynchronizer(self.config)
-        self.eval = WaveletEvaluator(self.config.wavelet_scales)
+        self.eval = WaveletEvaluator(
+            self.config.wavelet_scales, self.config.wavelet_engine, self.config.chebyshev_order, self.spectral_cache,
+            self.config.wavelet_storage, self.config.wavelet_storage_dir, self.config.feature_columns)
         self.commander = CommandPost(self.config)
 
         if self.config.classifier == 'top':
@@ -87,6 +105,7 @@ class GraphClient(Node):
         # Key management to keep track of the received messages.
         self.optimized_keys = []
         self.keys = []
+        self.has_optimized_changes = False
 
         self.mutex.release()
         self.is_initialized = True
@@ -129,6 +148,10 @@ class GraphClient(Node):
         Logger.LogInfo(
             f'GraphClient: Received opt trajectory message from {keys}.')
 
+        changes = self.optimized_signal.get_changes(self.config.robot_name)
+        if changes is not None and changes.has_changes():
+            self.has_optimized_changes = True
+
         for key in keys:
             if self.key_in_optimized_keys(key):
                 continue
@@ -154,7 +177,7 @@ class GraphClient(Node):
         if self.latest_traj_msg == None:
             return False
 
-        key = self.signal.convert_signal_from_path(
+        key = self.signal.ingest_signal_from_path(
             self.latest_traj_msg, self.config.robot_name)
         if not key:
             Logger.LogError('GraphClient: Unable to convert msg to signal.')
@@ -201,6 +224,17 @@ class GraphClient(Node):
             Logger.LogWarn('GraphClient: No new data received.')
             return
 
+        # Nothing to evaluate if neither trajectory changed since the last update.
+        est_changes = self.signal.get_changes(self.config.robot_name)
+        if not self.has_optimized_changes and est_changes is not None and not est_changes.has_changes():
+            self.mutex.acquire()
+            self.is_updating = False
+            self.mutex.release()
+            Logger.LogInfo(
+                'GraphClient: Trajectories did not change. Skipping update.')
+            return
+        self.has_optimized_changes = False
+
         self.compare_estimations()
         if self.config.visualize_graph:
             self.global_graph.publish()
@@ -320,28 +354,12 @@ class GraphClient(Node):
             return (None, None)
 
         # Reduce the robot graph and compute the wavelet basis functions.
-        positions = np.array([np.array(x.position) for x in all_est_nodes])
-        orientations = np.array([np.array(x.orientation)
-                                for x in all_est_nodes])
-        timestamps = np.array(
-            [np.array(Utils.ros_time_msg_to_ns(x.ts)) for x in all_est_nodes])
-        poses = np.column_stack([positions, orientations, timestamps])
+        poses = all_est_nodes.get_poses()
 
         # TODO(lbern): fix this temporary test
         # Due to the reduction we rebuild here.
-        positions = np.array([np.array(x.position) for x in all_opt_nodes])
-        orientations = np.array([np.array(x.orientation)
-                                for x in all_opt_nodes])
-        timestamps = np.array(
-            [np.array(Utils.ros_time_msg_to_ns(x.ts)) for x in all_opt_nodes])
-        global_poses = np.column_stack([positions, orientations, timestamps])
+        global_poses = all_opt_nodes.get_poses()
         self.global_graph.build_from_poses(global_poses)
-
-        if self.config.use_graph_hierarchies:
-            self.global_graph.build_hierarchies()
-
-        if self.config.client_mode == 'multiscale':
-            self.eval.compute_wavelets(self.global_graph.get_graph())
         return (all_opt_nodes, all_est_nodes)
 
     def check_for_degeneracy(self, all_opt_nodes, all_est_nodes):
@@ -350,9 +368,7 @@ class GraphClient(Node):
         Logger.LogInfo('GraphClient: Checking for degeneracy.')
         n_nodes = len(all_opt_nodes)
         assert n_nodes == len(all_est_nodes)
-        for i in range(0, n_nodes):
-            if not all_est_nodes[i].degenerate:
-                continue
+        for i in np.flatnonzero(all_est_nodes.degenerate):
             pivot = self.config.degenerate_window // 2
             begin_send = max(i - pivot, 0)
             end_send = min(
@@ -390,12 +406,9 @@ class GraphClient(Node):
         x_opt = self.optimized_signal.compute_signal(all_opt_nodes)
 
         if self.config.use_graph_hierarchies:
-            indices = self.global_graph.get_indices()
-            # all_est_nodes = [all_est_nodes[i] for i in robot_indices]
-            # all_opt_nodes = [all_opt_nodes[i] for i in server_indices]
-            n_nodes = len(all_est_nodes)
-            x_est = self.signal.marginalize_signal(x_est, indices, n_nodes)
-            x_opt = self.signal.marginalize_signal(x_opt, indices, n_nodes)
+            clusters = self.global_graph.get_clusters()
+            x_est = self.signal.marginalize_signal(x_est, clusters)
+            x_opt = self.signal.marginalize_signal(x_opt, clusters)
 
         self.record_all_signals(x_est, x_opt)
         self.record_synchronized_trajectories(self.signal.compute_trajectory(
@@ -420,8 +433,10 @@ class GraphClient(Node):
                 Logger.LogError('---- STOPPING --------------------')
                 return None
 
-        psi = self.eval.get_wavelets()
-        n_dim = psi.shape[0]
+        # The wavelets are only needed once the stop criteria passed.
+        self.eval.compute_wavelets(self.global_graph.get_graph())
+
+        n_dim = self.eval.get_graph_size()
         if n_dim != x_est.shape[0] or n_dim != x_opt.shape[0]:
             Logger.LogWarn(
                 f'GraphClient We have a size mismatch: {n_dim} vs. {x_est.shape[0]} vs. {x_opt.shape[0]}.')
@@ -430,15 +445,14 @@ class GraphClient(Node):
         Logger.LogInfo('Computing features.')
         # Compute all the wavelet coefficients.
         # We will filter them later per submap.
-        W_est = self.eval.compute_wavelet_coeffs(x_est)
-        W_opt = self.eval.compute_wavelet_coeffs(x_opt)
+        W_est, W_opt = self.eval.compute_wavelet_coeffs_batch([x_est, x_opt])
         features = self.eval.compute_features(W_opt, W_est)
         self.record_features(features)
 
         labels = self.classifier.classify(features)
         if self.config.use_graph_hierarchies:
             if self.config.use_downstreaming:
-                return DownstreamResult(self.config, key, all_opt_nodes, features, labels, self.global_graph.get_indices())
+                return DownstreamResult(self.config, key, all_opt_nodes, features, labels, self.global_graph.get_clusters())
             else:
                 return WindowedResult(self.config, key, all_opt_nodes, all_est_nodes, features, labels, self.global_graph)
         else:
@@ -486,9 +500,13 @@ class GraphClient(Node):
 def main(args=None):
     rclpy.init(args=args)
     client = GraphClient()
-    rclpy.spin(client)
-    client.destroy_node()
-    rclpy.shutdown()
+    try:
+        rclpy.spin(client)
+    finally:
+        # Also release the workers and shared memory on interrupts.
+        client.construction_pool.shutdown()
+        client.destroy_node()
+        rclpy.shutdown()
 
 
 if __name__ == '__main__':
@@ -140,9 +140,11 @@ class GraphMonitor(Node):
 def main(args=None):
     rclpy.init(args=args)
     monitor = GraphMonitor()
-    rclpy.spin(monitor)
-    monitor.destroy_node()
-    rclpy.shutdown()
+    try:
+        rclpy.spin(monitor)
+    finally:
+        monitor.destroy_node()
+        rclpy.shutdown()
 
 
 if __name__ == '__main__':